@@ -0,0 +1,125 @@
+"""
+Measures how fast 1, 4 and 16 worker processes claim events with
+actions.event.reserve_for_worker, and checks that no event is claimed twice.
+
+Needs a migrated Postgres without other queued events, since the workers claim
+whatever is due:
+
+    python -m bench.reserve_events --events 20000 --workers 1 --workers 4 --workers 16
+"""
+
+import asyncio
+import multiprocessing
+import time
+import uuid
+
+import click
+from tortoise import Tortoise
+
+from quart_starter import actions, enums, models, schemas, settings
+
+NAME = "bench.reserve"
+
+
+async def claim_all(barrier, results, batch_size: int) -> None:
+    await Tortoise.init(config=settings.TORTOISE_ORM)
+    try:
+        user = schemas.User.system_user()
+        worker_id = str(uuid.uuid4())
+        claimed = []
+
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+        while True:
+            events = await actions.event.reserve_for_worker(
+                user, worker_id, limit=batch_size
+            )
+            if not events:
+                break
+
+            ids = [event.id for event in events]
+            claimed.extend(ids)
+            await models.Event.filter(id__in=ids).update(
+                status=enums.EventStatus.PROCESSED, worker_id=None
+            )
+
+        results.put(claimed)
+    finally:
+        await Tortoise.close_connections()
+
+
+def run_worker(barrier, results, batch_size: int) -> None:
+    asyncio.run(claim_all(barrier, results, batch_size))
+
+
+async def seed(num_events: int) -> None:
+    await Tortoise.init(config=settings.TORTOISE_ORM)
+    try:
+        others = (
+            models.Event.filter(status=enums.EventStatus.QUEUED)
+            .exclude(name=NAME)
+            .exists()
+        )
+        if await others:
+            raise click.ClickException("the database has queued events of its own")
+
+        await models.Event.filter(name=NAME).delete()
+        await models.Event.bulk_create(
+            [models.Event(name=NAME, data={}) for _ in range(num_events)],
+            batch_size=1000,
+        )
+    finally:
+        await Tortoise.close_connections()
+
+
+async def cleanup() -> None:
+    await Tortoise.init(config=settings.TORTOISE_ORM)
+    try:
+        await models.Event.filter(name=NAME).delete()
+    finally:
+        await Tortoise.close_connections()
+
+
+def bench(num_workers: int, num_events: int, batch_size: int) -> None:
+    asyncio.run(seed(num_events))
+
+    context = multiprocessing.get_context("spawn")
+    # the clock starts once every worker is connected
+    barrier = context.Barrier(num_workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(barrier, results, batch_size))
+        for _ in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    barrier.wait(60)
+    started = time.perf_counter()
+    claimed = [event_id for _ in processes for event_id in results.get()]
+    elapsed = time.perf_counter() - started
+
+    for process in processes:
+        process.join()
+
+    click.echo(
+        f"workers={num_workers:>3}  {len(claimed) / elapsed:10.0f} events/s"
+        f"  claimed={len(claimed)} duplicates={len(claimed) - len(set(claimed))}"
+    )
+
+
+@click.command()
+@click.option("--events", default=20000, show_default=True)
+@click.option(
+    "--workers", multiple=True, type=int, default=[1, 4, 16], show_default=True
+)
+@click.option("--batch-size", default=settings.WEBHOOK_CONCURRENCY, show_default=True)
+def main(events, workers, batch_size):
+    try:
+        for num_workers in workers:
+            bench(num_workers, events, batch_size)
+    finally:
+        asyncio.run(cleanup())
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,139 @@
+"""
+Joins, broadcasts to, churns and leaves many websocket channels through a
+WebsocketManager and reports timings and the number of SUBSCRIBE/UNSUBSCRIBE
+commands sent.
+
+    python -m bench.websocket_channels --channels 10000 --sockets 10
+"""
+
+import asyncio
+import time
+
+import click
+
+from quart_starter import settings
+from quart_starter.lib.pubsub import get_pubsub_manager
+from quart_starter.lib.websocket import WebsocketManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send(self, _data):
+        self.received += 1
+
+    async def close(self, *_):
+        pass
+
+
+def count_commands(manager: WebsocketManager) -> dict:
+    commands = {"subscribe": 0, "unsubscribe": 0}
+
+    for shard in manager.shards:
+        client = shard.pubsub_client
+
+        def counted(name, method):
+            async def wrapped(*channel_ids):
+                commands[name] += 1
+                return await method(*channel_ids)
+
+            return wrapped
+
+        client.subscribe = counted("subscribe", client.subscribe)
+        client.unsubscribe = counted("unsubscribe", client.unsubscribe)
+
+    return commands
+
+
+async def settle(manager: WebsocketManager) -> None:
+    # wait for the batched subscription changes to go out
+    delay = manager.shards[0].batch_delay
+    while True:
+        await asyncio.sleep(delay * 2)
+        if not any(shard.pending for shard in manager.shards):
+            return
+
+
+def report(phase: str, started: float, commands: dict) -> None:
+    click.echo(
+        f"{phase:>10}: {time.perf_counter() - started:8.3f}s"
+        f"  subscribe={commands['subscribe']} unsubscribe={commands['unsubscribe']}"
+    )
+    commands["subscribe"] = commands["unsubscribe"] = 0
+
+
+async def run(backend, num_channels, num_sockets, connections, batch_ms, churn):
+    manager = WebsocketManager(
+        [get_pubsub_manager(backend) for _ in range(connections)],
+        send_queue_size=settings.WEBSOCKET_SEND_QUEUE_SIZE,
+        subscribe_batch_delay=batch_ms / 1000,
+    )
+    commands = count_commands(manager)
+
+    channel_ids = [f"bench-{i}" for i in range(num_channels)]
+    sockets = {c: [FakeSocket() for _ in range(num_sockets)] for c in channel_ids}
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            manager.add_user_to_channel(channel_id, socket)
+            for channel_id in channel_ids
+            for socket in sockets[channel_id]
+        )
+    )
+    await settle(manager)
+    report("join", started, commands)
+
+    started = time.perf_counter()
+    for channel_id in channel_ids:
+        await manager.broadcast_to_channel(channel_id, "hello")
+    expected = num_channels * num_sockets
+    while sum(s.received for c in channel_ids for s in sockets[c]) < expected:
+        await asyncio.sleep(0.01)
+    report("broadcast", started, commands)
+
+    # every socket of the churned channels leaves and a new one joins right away
+    async def rejoin(channel_id):
+        for socket in sockets[channel_id]:
+            await manager.remove_user_from_channel(channel_id, socket)
+        sockets[channel_id] = [FakeSocket() for _ in range(num_sockets)]
+        for socket in sockets[channel_id]:
+            await manager.add_user_to_channel(channel_id, socket)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(rejoin(channel_id) for channel_id in channel_ids[: int(num_channels * churn)])
+    )
+    await settle(manager)
+    report("churn", started, commands)
+
+    started = time.perf_counter()
+    for channel_id in channel_ids:
+        for socket in sockets[channel_id]:
+            await manager.remove_user_from_channel(channel_id, socket)
+    await settle(manager)
+    report("leave", started, commands)
+
+
+@click.command()
+@click.option("--backend", default="memory", show_default=True)
+@click.option("--channels", default=10000, show_default=True)
+@click.option("--sockets", default=10, show_default=True, help="Sockets per channel")
+@click.option(
+    "--connections",
+    default=settings.WEBSOCKET_PUBSUB_CONNECTIONS,
+    show_default=True,
+    help="Pubsub connections the channels are sharded across",
+)
+@click.option("--batch-ms", default=settings.WEBSOCKET_SUBSCRIBE_BATCH_MS)
+@click.option("--churn", default=0.1, show_default=True, help="Share of channels")
+def main(backend, channels, sockets, connections, batch_ms, churn):
+    asyncio.run(run(backend, channels, sockets, connections, batch_ms, churn))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "post" ADD "unique_viewers" INT NOT NULL  DEFAULT 0;
+        ALTER TABLE "post" ADD "viewers_sketch" BYTEA;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "post" DROP COLUMN "unique_viewers";
+        ALTER TABLE "post" DROP COLUMN "viewers_sketch";"""
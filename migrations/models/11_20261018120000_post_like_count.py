@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "post" ADD "like_count" INT NOT NULL  DEFAULT 0;
+        UPDATE "post" SET "like_count" = "counts"."num_likes"
+        FROM (
+            SELECT "post_id", COUNT(*) AS "num_likes" FROM "postlike" GROUP BY "post_id"
+        ) AS "counts"
+        WHERE "post"."id" = "counts"."post_id";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "post" DROP COLUMN "like_count";"""
@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "event" ADD "lease_expires_at" TIMESTAMPTZ;
+        UPDATE "event" SET "lease_expires_at" = "modified_at" + INTERVAL '3 minutes'
+        WHERE "status" = 'queued' AND "worker_id" IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS "idx_event_queued_next_attempt_at" ON "event" ("next_attempt_at") WHERE "status" = 'queued';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_event_queued_next_attempt_at";
+        ALTER TABLE "event" DROP COLUMN "lease_expires_at";"""
@@ -0,0 +1,27 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "event_archive" (
+    "id" INT NOT NULL PRIMARY KEY,
+    "name" VARCHAR(128) NOT NULL,
+    "data" JSONB NOT NULL,
+    "status" VARCHAR(16) NOT NULL,
+    "num_attempts" INT NOT NULL  DEFAULT 0,
+    "attempted_at" TIMESTAMPTZ,
+    "response_code" INT,
+    "response_text" VARCHAR(256),
+    "created_at" TIMESTAMPTZ NOT NULL,
+    "modified_at" TIMESTAMPTZ NOT NULL,
+    "archived_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS "idx_event_archi_archive_5d3a1c" ON "event_archive" ("archived_at");
+COMMENT ON COLUMN "event_archive"."status" IS 'QUEUED: queued\nPROCESSED: processed\nFAILED: failed';
+        CREATE INDEX IF NOT EXISTS "idx_event_done_modified_at" ON "event" ("modified_at") WHERE "status" <> 'queued';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_event_done_modified_at";
+        DROP TABLE IF EXISTS "event_archive";"""
@@ -0,0 +1,23 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX IF NOT EXISTS "idx_event_queued_worker_id" ON "event" ("worker_id") WHERE "status" = 'queued';
+        CREATE INDEX IF NOT EXISTS "idx_event_status_created_at" ON "event" ("status", "created_at" DESC, "id" DESC);
+        CREATE INDEX IF NOT EXISTS "idx_post_status_published_at" ON "post" ("status", "published_at" DESC, "created_at" DESC, "id" DESC);
+        CREATE INDEX IF NOT EXISTS "idx_post_author_status_published_at" ON "post" ("author_id", "status", "published_at" DESC, "created_at" DESC, "id" DESC);
+        CREATE INDEX IF NOT EXISTS "idx_post_published_at" ON "post" ("published_at" DESC, "created_at" DESC, "id" DESC);
+        CREATE INDEX IF NOT EXISTS "idx_postlike_user_id" ON "postlike" ("user_id");
+        CREATE INDEX IF NOT EXISTS "idx_token_user_id" ON "token" ("user_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_event_queued_worker_id";
+        DROP INDEX IF EXISTS "idx_event_status_created_at";
+        DROP INDEX IF EXISTS "idx_post_status_published_at";
+        DROP INDEX IF EXISTS "idx_post_author_status_published_at";
+        DROP INDEX IF EXISTS "idx_post_published_at";
+        DROP INDEX IF EXISTS "idx_postlike_user_id";
+        DROP INDEX IF EXISTS "idx_token_user_id";"""
@@ -1,16 +1,43 @@
 import datetime as dt
+import json
 from typing import List, Union
+from urllib.parse import urlsplit
 
-import requests
-from requests.exceptions import RequestException
+import httpx
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
 
 from quart_starter import enums, models, schemas, settings
+from quart_starter.lib.cache import invalidator
+from quart_starter.lib.circuit_breaker import CircuitBreaker, Permit
 from quart_starter.lib.error import ActionError, ForbiddenActionError
+from quart_starter.lib.notify import notify
+from quart_starter.lib.webhook import WebhookDispatcher
 
 from .helpers import conditional_set, handle_orm_errors
 
 MAX_NUM_ATTEMPTS = 5
 
+QUEUED_CHANNEL = "event_queued"
+
+dispatcher = WebhookDispatcher(
+    settings.WEBHOOK_URL,
+    concurrency=settings.WEBHOOK_CONCURRENCY,
+    timeout=settings.WEBHOOK_TIMEOUT,
+    batch_size=settings.WEBHOOK_BATCH_SIZE,
+    batch_wait=settings.WEBHOOK_BATCH_WAIT_MS / 1000,
+    target_latency=settings.WEBHOOK_TARGET_LATENCY,
+)
+
+breaker = CircuitBreaker(
+    "webhook-breaker",
+    failure_threshold=settings.WEBHOOK_BREAKER_FAILURES,
+    reset_timeout=settings.WEBHOOK_BREAKER_RESET,
+    probe_timeout=settings.WEBHOOK_TIMEOUT * 2,
+)
+
+DESTINATION = urlsplit(settings.WEBHOOK_URL).netloc
+
 
 def has_permission(
     user: schemas.User,
@@ -60,14 +87,20 @@ async def get(
     return schemas.Event.model_validate(event)
 
 
+def visible_to(_user: schemas.User) -> QuerySet:
+    """
+    The events `user` may list.
+    """
+    return models.Event.all()
+
+
 @handle_orm_errors
-async def query(_user: schemas.User, q: schemas.EventQuery) -> schemas.EventResultSet:
-    qs = models.Event.all()
-    queryset, pagination = await q.apply(qs)
+async def query(user: schemas.User, q: schemas.EventQuery) -> schemas.EventResultSet:
+    objs, pagination = await q.apply(visible_to(user))
 
     return schemas.EventResultSet(
         pagination=pagination,
-        events=[schemas.Event.model_validate(event) for event in await queryset],
+        events=[schemas.Event.model_validate(event) for event in objs],
     )
 
 
@@ -82,6 +115,11 @@ async def create(user: schemas.User, data: schemas.EventCreate) -> schemas.Event
 
     await event.save()
 
+    # wakes up idle workers once the event is committed
+    await notify(QUEUED_CHANNEL)
+
+    await invalidator.invalidate("count", {"model": "Event"})
+
     return schemas.Event.model_validate(event)
 
 
@@ -95,6 +133,7 @@ async def delete(user: schemas.User, id: int) -> None:
         raise ForbiddenActionError()
 
     await event.delete()
+    await invalidator.invalidate("count", {"model": "Event"})
 
 
 @handle_orm_errors
@@ -119,89 +158,336 @@ async def update(
 
 
 @handle_orm_errors
-async def reset_abandoned(_user: schemas.User):
+async def next_attempt_delay(_user: schemas.User, maximum: float) -> float:
+    """
+    Returns the number of seconds until the earliest unclaimed event is due, capped
+    at `maximum`.
+    """
     now = dt.datetime.now(dt.timezone.utc)
+    next_attempt_at = await (
+        models.Event.filter(
+            Q(worker_id__isnull=True) | Q(lease_expires_at__lt=now),
+            status=enums.EventStatus.QUEUED,
+        )
+        .order_by("next_attempt_at")
+        .limit(1)
+        .values_list("next_attempt_at", flat=True)
+    )
+    if not next_attempt_at:
+        return maximum
+
+    delay = next_attempt_at[0] - now
+    return min(maximum, max(0, delay.total_seconds()))
+
+
+# rows locked by another worker's claim are skipped rather than waited on, so
+# concurrent workers never claim the same event, and expired leases of crashed
+# workers are reclaimed as part of the claim
+def _event_from_row(row: dict) -> schemas.Event:
+    # raw queries skip the model's field conversion, asyncpg returns JSON as text
+    if isinstance(row["data"], str):
+        row = {**row, "data": json.loads(row["data"])}
+    return schemas.Event.model_validate(row)
+
+
+# statuses are written into the statements rather than passed as parameters, so
+# generic plans can still match them against the partial indexes' predicates
+RESERVE_SQL = f"""
+UPDATE "event"
+SET "worker_id" = $1,
+    "lease_expires_at" = NOW() + $3::FLOAT * INTERVAL '1 second',
+    "modified_at" = NOW()
+WHERE "id" IN (
+    SELECT "id" FROM "event"
+    WHERE "status" = '{enums.EventStatus.QUEUED.value}'
+        AND (
+            "worker_id" IS NULL
+            OR "worker_id" = $1
+            OR "lease_expires_at" < NOW()
+        )
+        AND "next_attempt_at" <= NOW()
+    ORDER BY "next_attempt_at"
+    LIMIT $2
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING *
+"""
 
-    qs = models.Event.filter(
-        status=enums.EventStatus.QUEUED,
-        worker_id__not_isnull=True,
-        modified_at__lte=now - dt.timedelta(minutes=3),
+
+@handle_orm_errors
+async def reserve_for_worker(
+    _user: schemas.User, worker_id: str, limit=5, lease=60
+) -> List[schemas.Event]:
+    """
+    Claims up to `limit` due events for the worker, including ones it claimed
+    earlier but did not get to.  The claim lasts `lease` seconds unless renewed.
+
+    Returns:
+        List[Event]: The claimed events, in the order they are due.
+    """
+    rows = await models.Event._meta.db.execute_query_dict(
+        RESERVE_SQL, [worker_id, limit, lease]
     )
 
-    events = await qs
-    if events:
-        for event in events:
-            event.worker_id = None
+    events = [_event_from_row(row) for row in rows]
+    events.sort(key=lambda event: event.next_attempt_at)
+
+    return events
 
-        await models.Event.bulk_update(events, fields=["worker_id"])
+
+# events locked by a concurrent claim or write-back are skipped rather than
+# waited on, they are renewed on the next round
+RENEW_SQL = f"""
+UPDATE "event"
+SET "lease_expires_at" = NOW() + $2::FLOAT * INTERVAL '1 second'
+WHERE "id" IN (
+    SELECT "id" FROM "event"
+    WHERE "status" = '{enums.EventStatus.QUEUED.value}' AND "worker_id" = $1
+    FOR UPDATE SKIP LOCKED
+)
+"""
 
 
 @handle_orm_errors
-async def reserve_for_worker(_user: schemas.User, worker_id: str, limit=5) -> None:
-    now = dt.datetime.now(dt.timezone.utc)
-    qs = (
-        models.Event.filter(
-            status=enums.EventStatus.QUEUED,
-            worker_id__isnull=True,
-            next_attempt_at__lte=now,
-        )
-        .limit(limit)
-        .order_by("next_attempt_at")
+async def renew_leases(_user: schemas.User, worker_id: str, lease=60) -> int:
+    """
+    Extends the worker's claims by another `lease` seconds.
+
+    Returns:
+        int: Number of claims renewed.
+    """
+    renewed, _ = await models.Event._meta.db.execute_query(
+        RENEW_SQL, [worker_id, lease]
     )
+    return renewed
 
-    events = await qs
-    if events:
-        for event in events:
-            event.worker_id = worker_id
 
-        await models.Event.bulk_update(events, fields=["worker_id"])
+@handle_orm_errors
+async def release_for_worker(_user: schemas.User, worker_id: str) -> int:
+    """
+    Hands events the worker claimed but did not deliver back to the queue.
+
+    Returns:
+        int: Number of events released.
+    """
+    released = await models.Event.filter(
+        status=enums.EventStatus.QUEUED, worker_id=worker_id
+    ).update(worker_id=None, lease_expires_at=None)
+
+    if released:
+        await notify(QUEUED_CHANNEL)
+
+    return released
+
+
+async def check_breaker(_user: schemas.User) -> Permit:
+    """
+    Asks the destination's circuit breaker whether deliveries may go out, before
+    anything is claimed.  Half-open means the caller gets to send a single probe.
+
+    Returns:
+        Permit: Open with the seconds to wait before asking again, otherwise closed
+            or half-open.
+    """
+    permit = await breaker.allow(DESTINATION)
+    if not permit.allowed and not permit.retry_after:
+        # another worker is probing, give it the time it may take
+        return Permit(permit.state, breaker.probe_timeout)
+    return permit
+
+
+# backoff is 1, 3, 5, ... minutes, "num_attempts" still holds the old value here.
+# attempts whose outcome was never saved still count, so events that already used
+# up their attempts are failed instead of being sent again
+START_ATTEMPTS_SQL = f"""
+WITH exhausted AS (
+    UPDATE "event"
+    SET "status" = '{enums.EventStatus.FAILED.value}',
+        "worker_id" = NULL,
+        "lease_expires_at" = NULL,
+        "modified_at" = NOW()
+    WHERE "id" = ANY($1::INT[]) AND "worker_id" = $2
+        AND "status" = '{enums.EventStatus.QUEUED.value}' AND "num_attempts" >= $3
+)
+UPDATE "event"
+SET "num_attempts" = "num_attempts" + 1,
+    "attempted_at" = NOW(),
+    "next_attempt_at" = NOW() + (2 * "num_attempts" + 1) * INTERVAL '1 minute',
+    "modified_at" = NOW()
+WHERE "id" = ANY($1::INT[]) AND "worker_id" = $2
+    AND "status" = '{enums.EventStatus.QUEUED.value}' AND "num_attempts" < $3
+RETURNING *
+"""
 
 
 @handle_orm_errors
-async def reserved_for_worker(
-    _user: schemas.User, worker_id: str
+async def start_attempts(
+    _user: schemas.User, worker_id: str, ids: List[int]
 ) -> List[schemas.Event]:
-    qs = models.Event.filter(status=enums.EventStatus.QUEUED, worker_id=worker_id)
+    """
+    Counts an attempt and schedules the retry for every event in the batch the
+    worker still holds, before anything is sent.  A worker dying mid delivery
+    leaves the events to be retried after their backoff, at least once.  Events
+    out of attempts are marked failed and left out.
+
+    Returns:
+        List[Event]: The events to deliver.
+    """
+    if not ids:
+        return []
+
+    rows = await models.Event._meta.db.execute_query_dict(
+        START_ATTEMPTS_SQL,
+        [ids, worker_id, MAX_NUM_ATTEMPTS],
+    )
 
-    return [schemas.Event.model_validate(event) for event in await qs]
+    events = [_event_from_row(row) for row in rows]
+    events.sort(key=lambda event: ids.index(event.id))
 
+    return events
 
-@handle_orm_errors
-async def worker_webhook(_user: schemas.User, id: int, worker_id: str) -> bool:
-    event = await models.Event.get(id=id).select_for_update()
 
-    if worker_id != event.worker_id:
-        return
+def handle_failure(event: schemas.Event) -> None:
+    # hands the event back for the retry scheduled by start_attempts, if any is left
+    if event.num_attempts >= MAX_NUM_ATTEMPTS:
+        event.status = enums.EventStatus.FAILED
+    else:
+        event.worker_id = None
 
-    event.num_attempts += 1
-    event.attempted_at = dt.datetime.now(dt.timezone.utc)
-    event.next_attempt_at = event.attempted_at + dt.timedelta(
-        minutes=(2 * (event.num_attempts - 1) + 1)
-    )
-    await event.save()
 
-    def handle_failure(event):
-        if event.num_attempts == MAX_NUM_ATTEMPTS:
-            event.status = enums.EventStatus.FAILED
-        else:
-            event.worker_id = None
+def abandon_attempt(event: schemas.Event, error: Exception) -> schemas.Event:
+    """
+    Records an attempt that ended in an unexpected error as failed, so
+    `save_outcomes` releases the event rather than leaving it claimed.
+    """
+    event.response_code = -1
+    event.response_text = str(error)[:256]
+    handle_failure(event)
+
+    return event
+
 
+async def send_webhook(event: schemas.Event) -> schemas.Event:
+    """
+    Delivers an event whose attempt was started.  Nothing is written, the outcome
+    is applied to the returned event for `save_outcomes`.
+    """
     try:
-        r = requests.post(
-            settings.WEBHOOK_URL,
-            json={"name": event.name, "data": event.data},
-            timeout=5,
+        r = await dispatcher.post_batched(
+            event.id, {"name": event.name, "data": event.data}
         )
         event.response_code = r.status_code
-        event.response_text = r.text[:256]
+        event.response_text = r.text
 
         if r.status_code == 200 and r.text.strip() == "OK":
             event.status = enums.EventStatus.PROCESSED
         else:
             handle_failure(event)
-    except RequestException as e:
+
+        # the receiver rejecting an event says nothing about its health
+        if r.status_code >= 500:
+            await breaker.record_failure(DESTINATION)
+        else:
+            await breaker.record_success(DESTINATION)
+    except httpx.HTTPError as e:
         event.response_code = -1
         event.response_text = str(e)[:256]
         handle_failure(event)
-    finally:
-        await event.save()
+
+        await breaker.record_failure(DESTINATION)
+
+    return event
+
+
+@handle_orm_errors
+async def save_outcomes(
+    _user: schemas.User, worker_id: str, events: List[schemas.Event]
+) -> None:
+    """
+    Writes back the delivery outcomes of a batch in one statement.  Events whose
+    lease was lost to another worker in the meantime are left alone.
+    """
+    if not events:
+        return
+
+    values = ", ".join(
+        f"(${i * 5 + 1}::INT, ${i * 5 + 2}::VARCHAR, ${i * 5 + 3}::VARCHAR,"
+        f" ${i * 5 + 4}::INT, ${i * 5 + 5}::VARCHAR)"
+        for i in range(len(events))
+    )
+    await models.Event._meta.db.execute_query(
+        f"""
+        UPDATE "event"
+        SET "status" = v.status,
+            "worker_id" = v.worker_id,
+            "lease_expires_at" = CASE
+                WHEN v.worker_id IS NULL THEN NULL
+                ELSE "event"."lease_expires_at"
+            END,
+            "response_code" = v.response_code,
+            "response_text" = v.response_text,
+            "modified_at" = NOW()
+        FROM (VALUES {values})
+            AS v(id, status, worker_id, response_code, response_text)
+        WHERE "event"."id" = v.id AND "event"."worker_id" = ${len(events) * 5 + 1}
+        """,
+        [
+            x
+            for event in events
+            for x in (
+                event.id,
+                str(event.status),
+                event.worker_id,
+                event.response_code,
+                event.response_text,
+            )
+        ]
+        + [worker_id],
+    )
+
+
+# bounded batches keep each transaction, and the locks it holds, short
+PRUNE_SQL = f"""
+WITH pruned AS (
+    DELETE FROM "event"
+    WHERE "id" IN (
+        SELECT "id" FROM "event"
+        WHERE "status" <> '{enums.EventStatus.QUEUED.value}' AND "modified_at" < $1
+        ORDER BY "modified_at"
+        LIMIT $2
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+), archived AS (
+    INSERT INTO "event_archive" (
+        "id", "name", "data", "status", "num_attempts", "attempted_at",
+        "response_code", "response_text", "created_at", "modified_at"
+    )
+    SELECT
+        "id", "name", "data", "status", "num_attempts", "attempted_at",
+        "response_code", "response_text", "created_at", "modified_at"
+    FROM pruned
+    WHERE $3::BOOLEAN
+    ON CONFLICT ("id") DO NOTHING
+)
+SELECT COUNT(*) AS "count" FROM pruned
+"""
+
+
+@handle_orm_errors
+async def prune(
+    _user: schemas.User, older_than: dt.datetime, archive=True, batch_size=1000
+) -> int:
+    """
+    Moves a batch of processed and failed events last modified before `older_than`
+    to the archive, or deletes them when `archive` is False.  Queued events are
+    never touched.
+
+    Returns:
+        int: Number of events removed, less than `batch_size` once done.
+    """
+    rows = await models.Event._meta.db.execute_query_dict(
+        PRUNE_SQL,
+        [older_than, batch_size, archive],
+    )
+    return rows[0]["count"]
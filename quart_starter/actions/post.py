@@ -1,9 +1,12 @@
-from typing import Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
-from tortoise.exceptions import DoesNotExist
-from tortoise.expressions import F, Q
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
 
-from quart_starter import enums, models, schemas
+from quart_starter import enums, models, schemas, settings
+from quart_starter.lib.cache import invalidator
+from quart_starter.lib.counter import BufferedCounter
+from quart_starter.lib.hyperloglog import UniqueCounter
 from quart_starter.lib.error import ActionError, ForbiddenActionError
 
 from .helpers import conditional_set, handle_orm_errors
@@ -63,17 +66,23 @@ async def get(
     return schemas.Post.model_validate(post)
 
 
-@handle_orm_errors
-async def query(user: schemas.User, q: schemas.PostQuery) -> schemas.PostResultSet:
+def visible_to(user: schemas.User) -> QuerySet:
+    """
+    The posts `user` may list.
+    """
     qs = models.Post.all()
     if user.role != enums.UserRole.ADMIN:
         qs = qs.filter(Q(_status=enums.PostStatus.PUBLISHED) | Q(author_id=user.id))
+    return qs
+
 
-    queryset, pagination = await q.apply(qs)
+@handle_orm_errors
+async def query(user: schemas.User, q: schemas.PostQuery) -> schemas.PostResultSet:
+    objs, pagination = await q.apply(visible_to(user))
 
     return schemas.PostResultSet(
         pagination=pagination,
-        posts=[schemas.Post.model_validate(post) for post in await queryset],
+        posts=[schemas.Post.model_validate(post) for post in objs],
     )
 
 
@@ -89,6 +98,8 @@ async def create(user: schemas.User, data: schemas.PostCreate) -> schemas.Post:
     post.update_status(data.status)
     await post.save()
 
+    await invalidator.invalidate("count", {"model": "Post"})
+
     return schemas.Post.model_validate(post)
 
 
@@ -102,6 +113,7 @@ async def delete(user: schemas.User, id: int) -> None:
         raise ForbiddenActionError()
 
     await post.delete()
+    await invalidator.invalidate("count", {"model": "Post"})
 
 
 @handle_orm_errors
@@ -124,9 +136,74 @@ async def update(user: schemas.User, id: int, data: schemas.PostPatch) -> schema
     return schemas.Post.model_validate(post)
 
 
-@handle_orm_errors
-async def view(_: schemas.User, id: int) -> None:
-    await models.Post.filter(id=id).update(viewed=F("viewed") + 1)
+async def flush_views(counts: Dict[int, int]) -> None:
+    values = ", ".join(
+        f"(${i * 2 + 1}::int, ${i * 2 + 2}::int)" for i in range(len(counts))
+    )
+    await models.Post._meta.db.execute_query(
+        f"""
+        UPDATE "post" SET "viewed" = "post"."viewed" + v.amount
+        FROM (VALUES {values}) AS v(id, amount)
+        WHERE "post"."id" = v.id
+        """,
+        [x for item in counts.items() for x in item],
+    )
+
+
+views = BufferedCounter(
+    "post:views",
+    flush_views,
+    interval=settings.POST_VIEW_FLUSH_INTERVAL,
+    threshold=settings.POST_VIEW_FLUSH_THRESHOLD,
+)
+
+
+async def load_viewers(id: int) -> Optional[bytes]:
+    sketches = await models.Post.filter(id=id).values_list("viewers_sketch", flat=True)
+    return sketches[0] if sketches else None
+
+
+async def snapshot_viewers(snapshots: Dict[int, Tuple[int, Optional[bytes]]]) -> None:
+    values = ", ".join(
+        f"(${i * 3 + 1}::int, ${i * 3 + 2}::int, ${i * 3 + 3}::bytea)"
+        for i in range(len(snapshots))
+    )
+    await models.Post._meta.db.execute_query(
+        f"""
+        UPDATE "post"
+        SET "unique_viewers" = GREATEST("post"."unique_viewers", v.count),
+            "viewers_sketch" = COALESCE(v.sketch, "post"."viewers_sketch")
+        FROM (VALUES {values}) AS v(id, count, sketch)
+        WHERE "post"."id" = v.id
+        """,
+        [x for id, (count, sketch) in snapshots.items() for x in (id, count, sketch)],
+    )
+
+
+viewers = UniqueCounter(
+    "post:viewers",
+    load_viewers,
+    snapshot_viewers,
+    interval=settings.POST_VIEWERS_SNAPSHOT_INTERVAL,
+    ttl=settings.POST_VIEWERS_TTL,
+)
+
+
+async def view(user: schemas.User, post: schemas.Post) -> schemas.Post:
+    """
+    Records a view of the post by the user.
+
+    Returns:
+        Post: The post with view counts that include this view, views are persisted
+            in batches so the stored counts lag behind.
+    """
+    # anonymous users all have id 0 but a random email per session
+    viewer = str(user.id) if user.id else f"anonymous:{user.email}"
+
+    post.viewed += await views.incr(post.id)
+    post.unique_viewers = max(post.unique_viewers, await viewers.add(post.id, viewer))
+
+    return post
 
 
 @handle_orm_errors
@@ -136,7 +213,54 @@ async def get_like(user: schemas.User, id: int) -> schemas.PostLike:
 
 
 @handle_orm_errors
-async def like(user: schemas.User, id: int) -> schemas.PostLike:
+async def get_liked(user: schemas.User, ids: List[int]) -> Set[int]:
+    """
+    Looks up which of the posts the user liked in a single query.
+
+    Returns:
+        Set[int]: Ids from `ids` the user liked.
+    """
+    if not user.id or not ids:
+        return set()
+
+    return set(
+        await models.PostLike.filter(user_id=user.id, post_id__in=ids).values_list(
+            "post_id", flat=True
+        )
+    )
+
+
+# the permission check from has_permission(READ) rides along in the SELECT, so a
+# like is checked, inserted and counted in one statement
+LIKE_SQL = """
+WITH liked AS (
+    INSERT INTO "postlike" ("post_id", "user_id")
+    SELECT "id", $2 FROM "post"
+    WHERE "id" = $1 AND ("status" = $3 OR "author_id" = $2 OR $4::BOOLEAN)
+    ON CONFLICT ("post_id", "user_id") DO NOTHING
+    RETURNING "id", "post_id", "user_id"
+), counted AS (
+    UPDATE "post" SET "like_count" = "post"."like_count" + 1
+    FROM liked
+    WHERE "post"."id" = liked."post_id"
+)
+SELECT "id", "post_id", "user_id" FROM liked
+"""
+
+UNLIKE_SQL = """
+WITH unliked AS (
+    DELETE FROM "postlike"
+    WHERE "post_id" = $1 AND "user_id" = $2
+    RETURNING "post_id"
+)
+UPDATE "post" SET "like_count" = "post"."like_count" - 1
+FROM unliked
+WHERE "post"."id" = unliked."post_id"
+RETURNING "post"."id"
+"""
+
+
+async def _check_can_like(user: schemas.User, id: int) -> None:
     post = await models.Post.get(id=id)
 
     if not has_permission(
@@ -144,26 +268,31 @@ async def like(user: schemas.User, id: int) -> schemas.PostLike:
     ):
         raise ForbiddenActionError()
 
-    try:
-        post_like = await models.PostLike.get(post_id=id, user_id=user.id)
-    except DoesNotExist:
-        post_like = await models.PostLike.create(post_id=id, user_id=user.id)
 
-    return schemas.PostLike.model_validate(post_like)
+@handle_orm_errors
+async def like(user: schemas.User, id: int) -> schemas.PostLike:
+    rows = await models.PostLike._meta.db.execute_query_dict(
+        LIKE_SQL,
+        [
+            id,
+            user.id,
+            enums.PostStatus.PUBLISHED.value,
+            user.role == enums.UserRole.ADMIN,
+        ],
+    )
+    if rows:
+        return schemas.PostLike(post=None, user=None, **rows[0])
+
+    # nothing was inserted, either it is already liked or the post can't be liked
+    await _check_can_like(user, id)
+    return await get_like(user, id)
 
 
 @handle_orm_errors
 async def unlike(user: schemas.User, id: int) -> None:
-    post = await models.Post.get(id=id)
-
-    if not has_permission(
-        user, schemas.Post.model_validate(post), enums.Permission.READ
-    ):
-        raise ForbiddenActionError()
+    _, rows = await models.PostLike._meta.db.execute_query(UNLIKE_SQL, [id, user.id])
+    if rows:
+        return
 
-    try:
-        post_like = await models.PostLike.get(post_id=id, user_id=user.id)
-    except DoesNotExist:
-        pass
-    else:
-        await post_like.delete()
+    # nothing was deleted, keep reporting missing and unreadable posts
+    await _check_can_like(user, id)
@@ -1,7 +1,10 @@
 import uuid
 from typing import Union
 
+from tortoise.queryset import QuerySet
+
 from quart_starter import enums, models, schemas
+from quart_starter.lib.cache import invalidator
 from quart_starter.lib.error import ActionError, ForbiddenActionError
 
 from .helpers import conditional_set, handle_orm_errors
@@ -66,17 +69,23 @@ async def get(
     return schemas.Token.model_validate(token)
 
 
-@handle_orm_errors
-async def query(user: schemas.User, q: schemas.TokenQuery) -> schemas.TokenResultSet:
+def visible_to(user: schemas.User) -> QuerySet:
+    """
+    The tokens `user` may list.
+    """
     qs = models.Token.all()
     if user.role != enums.UserRole.ADMIN:
         qs = qs.filter(user_id=user.id)
+    return qs
 
-    queryset, pagination = await q.apply(qs)
+
+@handle_orm_errors
+async def query(user: schemas.User, q: schemas.TokenQuery) -> schemas.TokenResultSet:
+    objs, pagination = await q.apply(visible_to(user))
 
     return schemas.TokenResultSet(
         pagination=pagination,
-        tokens=[schemas.Token.model_validate(token) for token in await queryset],
+        tokens=[schemas.Token.model_validate(token) for token in objs],
     )
 
 
@@ -93,6 +102,8 @@ async def create(
 
     await token.save()
 
+    await invalidator.invalidate("count", {"model": "Token"})
+
     return schemas.TokenCreateSuccess.model_validate(token)
 
 
@@ -106,6 +117,8 @@ async def delete(user: schemas.User, id: int) -> None:
         raise ForbiddenActionError()
 
     await token.delete()
+    await invalidator.invalidate("count", {"model": "Token"})
+    await invalidator.invalidate("auth", {"auth_id": token.auth_id})
 
 
 @handle_orm_errors
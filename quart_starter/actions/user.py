@@ -3,7 +3,10 @@ from typing import Union
 from tortoise.exceptions import DoesNotExist
 
 from quart_starter import enums, models, schemas, settings
+from quart_starter.lib.cache import invalidator
 from quart_starter.lib.error import ActionError, ForbiddenActionError
+from quart_starter.lib.password import password_hasher
+from quart_starter.lib.transaction import in_transaction
 
 from .helpers import conditional_set, handle_orm_errors
 
@@ -81,11 +84,11 @@ async def query(user: schemas.User, q: schemas.UserQuery) -> schemas.UserResultS
     if user.role != enums.UserRole.ADMIN:
         qs = qs.filter(id=user.id)
 
-    queryset, pagination = await q.apply(qs)
+    objs, pagination = await q.apply(qs)
 
     return schemas.UserResultSet(
         pagination=pagination,
-        users=[schemas.User.model_validate(user) for user in await queryset],
+        users=[schemas.User.model_validate(user) for user in objs],
     )
 
 
@@ -101,9 +104,11 @@ async def create(user: schemas.User, data: schemas.UserCreate) -> schemas.User:
     )
 
     if data.password:
-        obj.set_password(data.password)
+        await obj.set_password(data.password)
         await obj.save()
 
+    await invalidator.invalidate("count", {"model": "User"})
+
     return schemas.User.model_validate(obj)
 
 
@@ -116,7 +121,20 @@ async def delete(user: schemas.User, id: int) -> None:
     ):
         raise ForbiddenActionError()
 
-    await obj.delete()
+    async with in_transaction() as connection:
+        # the user's likes cascade away, take them off the denormalized counts first
+        await connection.execute_query(
+            """
+            UPDATE "post" SET "like_count" = "post"."like_count" - 1
+            FROM "postlike"
+            WHERE "postlike"."post_id" = "post"."id" AND "postlike"."user_id" = $1
+            """,
+            [id],
+        )
+        await obj.delete(using_db=connection)
+
+    await invalidator.invalidate("auth", {"user_id": id})
+    await invalidator.invalidate("count", {"model": "User"})
 
 
 @handle_orm_errors
@@ -133,13 +151,24 @@ async def update(user: schemas.User, id: int, data: schemas.UserPatch) -> schema
     conditional_set(obj, "picture", data.picture)
 
     await obj.save()
+    await invalidator.invalidate("auth", {"user_id": obj.id})
 
     return schemas.User.model_validate(obj)
 
 
 @handle_orm_errors
-async def check_password(id: int, password: str) -> bool:
-    user = await models.User.get(id=id)
+async def authenticate(email: str, password: str) -> Union[schemas.User, None]:
+    try:
+        obj = await models.User.get(email=email)
+    except DoesNotExist:
+        return None
+
+    if not await obj.check_password(password):
+        return None
 
-    return user.check_password(password)
-    return user.check_password(password)
+    # upgrade the hash while we have the plain text password, e.g. after a cost change
+    if password_hasher.needs_rehash(obj.hashed_password):
+        await obj.set_password(password)
+        await obj.save(update_fields=["hashed_password"])
+
+    return schemas.User.model_validate(obj)
@@ -1,3 +1,4 @@
+import asyncio
 import datetime as dt
 import urllib.parse
 from uuid import uuid4
@@ -21,12 +22,17 @@ from quart_schema.validation import (
 from tortoise.contrib.quart import register_tortoise
 from werkzeug.exceptions import NotFound
 
-from quart_starter import schemas, settings
+from quart_starter import actions, schemas, settings
 from quart_starter.command import register_commands
 from quart_starter.lib.auth import AuthUser, Forbidden
-from quart_starter.lib.error import ActionError, ForbiddenActionError
+from quart_starter.lib.cache import invalidator
+from quart_starter.lib.error import (
+    ActionError,
+    ForbiddenActionError,
+    RateLimitedActionError,
+)
 from quart_starter.lib.middleware import ProxyMiddleware
-from quart_starter.lib.pubsub import RedisPubSubManager
+from quart_starter.lib.pubsub import get_pubsub_manager
 from quart_starter.lib.websocket import WebsocketManager
 from quart_starter.log import register_logging
 
@@ -75,6 +81,26 @@ def register_blueprints(app):
     app.register_blueprint(user_blueprint, url_prefix="/user")
 
 
+def register_background_tasks(app):
+    coroutines = [
+        invalidator.listen,
+        actions.post.views.run,
+        actions.post.viewers.run,
+        app.socket_manager.run,
+    ]
+
+    @app.before_serving
+    async def start_background_tasks():
+        app.background_tasks = [asyncio.create_task(x()) for x in coroutines]
+
+    @app.after_serving
+    async def stop_background_tasks():
+        for task in app.background_tasks:
+            task.cancel()
+
+        await asyncio.gather(*app.background_tasks, return_exceptions=True)
+
+
 class MyQuartAuth(QuartAuth):
     def resolve_user(self) -> AuthUser:
         auth_id = self.load_cookie()
@@ -97,12 +123,25 @@ def create_app(**config_overrides):
 
     register_logging(app)
     register_blueprints(app)
+
+    app.socket_manager = WebsocketManager(
+        [get_pubsub_manager() for _ in range(settings.WEBSOCKET_PUBSUB_CONNECTIONS)],
+        send_queue_size=settings.WEBSOCKET_SEND_QUEUE_SIZE,
+        slow_consumer_policy=settings.WEBSOCKET_SLOW_CONSUMER_POLICY,
+        subscribe_batch_delay=settings.WEBSOCKET_SUBSCRIBE_BATCH_MS / 1000,
+        presence_ttl=settings.WEBSOCKET_PRESENCE_TTL,
+        presence_cache_ttl=settings.WEBSOCKET_PRESENCE_CACHE_TTL,
+        coalesce_window=settings.WEBSOCKET_COALESCE_MS / 1000,
+    )
+
+    # invalidations get their own connection so the websocket reader never sees them
+    invalidator.pubsub_client = get_pubsub_manager()
+
+    # registered ahead of tortoise so buffers drain before connections close
+    register_background_tasks(app)
     register_tortoise(app, config=app.config["TORTOISE_ORM"])
     register_commands(app)
 
-    pubsub_client = RedisPubSubManager("redis")
-    app.socket_manager = WebsocketManager(pubsub_client)
-
     # hide routes that don't have tags
     for rule in app.url_map.iter_rules():
         func = app.view_functions[rule.endpoint]
@@ -215,6 +254,13 @@ def create_app(**config_overrides):
             403,
         )
 
+    @app.errorhandler(RateLimitedActionError)
+    async def handle_rate_limited_error(error):
+        return (
+            schemas.Error(loc=error.loc, type=error.type, msg=str(error)),
+            429,
+        )
+
     @app.errorhandler(NotFound)
     async def handle_response_not_found_error(error):
         if has_request_context() and request.accept_mimetypes.accept_html:
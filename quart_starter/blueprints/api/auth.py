@@ -1,39 +1,54 @@
-from quart import Blueprint, current_app
+from quart import Blueprint, current_app, request
 from quart_auth import login_user
 from quart_schema import validate_request, validate_response
-from tortoise.transactions import atomic
 from unique_names_generator import get_random_name
 from unique_names_generator.data import ADJECTIVES, ANIMALS
 
-from quart_starter import actions, enums, schemas
-from quart_starter.lib.auth import AuthUser
-from quart_starter.lib.error import ActionError
+from quart_starter import actions, enums, schemas, settings
+from quart_starter.lib.auth import AuthUser, login_auth_id
+from quart_starter.lib.error import ActionError, RateLimitedActionError
+from quart_starter.lib.rate_limit import ConcurrencyLimiter, TokenBucketLimiter
+from quart_starter.lib.transaction import atomic, in_transaction
 
 blueprint = Blueprint("auth", __name__)
 
+login_ip_limiter = TokenBucketLimiter(
+    "login-ip", settings.LOGIN_IP_BUCKET_SIZE, settings.LOGIN_IP_REFILL_PER_MINUTE
+)
+login_email_limiter = TokenBucketLimiter(
+    "login-email",
+    settings.LOGIN_EMAIL_BUCKET_SIZE,
+    settings.LOGIN_EMAIL_REFILL_PER_MINUTE,
+)
+login_verifications = ConcurrencyLimiter(settings.LOGIN_MAX_CONCURRENT_VERIFICATIONS)
+
 
 @blueprint.post("/token")
 @validate_request(schemas.AuthTokenCreate)
 @validate_response(schemas.TokenCreateSuccess, 200)
-@atomic()
 async def token_create(data: schemas.AuthTokenCreate) -> schemas.TokenCreateSuccess:
-    user = None
-    try:
-        user = await actions.user.get(schemas.User.system_user(), email=data.email)
-    except ActionError as error:
-        if error.type != "action_error.does_not_exist":
-            raise
+    # reject floods before doing any bcrypt work or taking a connection for a
+    # transaction
+    if not await login_ip_limiter.acquire(request.remote_addr):
+        raise RateLimitedActionError(loc="remote_addr")
+
+    if not await login_email_limiter.acquire(data.email.lower()):
+        raise RateLimitedActionError(loc="email")
+
+    with login_verifications:
+        user = await actions.user.authenticate(data.email, data.password)
 
-    if user and await actions.user.check_password(user.id, data.password):
-        token = await actions.token.create(
-            user, enums.TokenType.WEB, schemas.TokenCreate(name="Web Login")
-        )
+    if user:
+        # only the writes run in a transaction, not the password check
+        async with in_transaction():
+            token = await actions.token.create(
+                user, enums.TokenType.WEB, schemas.TokenCreate(name="Web Login")
+            )
 
-        login_user(AuthUser(token.auth_id))
+        auth_id = login_auth_id(token, user)
+        login_user(AuthUser(auth_id))
 
-        token.auth_id = current_app.extensions["QUART_AUTH"][0].dump_token(
-            token.auth_id
-        )
+        token.auth_id = current_app.extensions["QUART_AUTH"][0].dump_token(auth_id)
 
         return token
 
@@ -56,5 +71,5 @@ async def user_create(data: schemas.AuthUserCreate) -> schemas.User:
         user, enums.TokenType.WEB, schemas.TokenCreate(name="Web Login")
     )
 
-    login_user(AuthUser(token.auth_id))
+    login_user(AuthUser(login_auth_id(token, user)))
     return user
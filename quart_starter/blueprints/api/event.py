@@ -1,9 +1,9 @@
 from quart import Blueprint
 from quart_auth import current_user, login_required
 from quart_schema import validate_querystring, validate_request, validate_response
-from tortoise.transactions import atomic
 
 from quart_starter import actions, schemas
+from quart_starter.lib.transaction import atomic
 
 blueprint = Blueprint("event", __name__)
 
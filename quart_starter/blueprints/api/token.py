@@ -1,9 +1,9 @@
 from quart import Blueprint, current_app
 from quart_auth import current_user, login_required
 from quart_schema import validate_querystring, validate_request, validate_response
-from tortoise.transactions import atomic
 
 from quart_starter import actions, enums, schemas
+from quart_starter.lib.transaction import atomic
 
 blueprint = Blueprint("token", __name__)
 
@@ -6,10 +6,11 @@ from google.oauth2 import id_token
 from google_auth_oauthlib.flow import Flow
 from pip._vendor import cachecontrol
 from quart import Blueprint, abort, current_app, redirect, request, session, url_for
-from quart_auth import AuthUser, login_user
+from quart_auth import login_user
 from quart_schema import hide
 
 from quart_starter import actions, enums, schemas
+from quart_starter.lib.auth import AuthUser, login_auth_id
 from quart_starter.lib.error import ActionError
 
 blueprint = Blueprint("google_auth", __name__, template_folder="templates")
@@ -92,7 +93,7 @@ async def callback():
         user, enums.TokenType.WEB, schemas.TokenCreate(name="Web Login")
     )
 
-    login_user(AuthUser(token.auth_id))
+    login_user(AuthUser(login_auth_id(token, user)))
     return redirect(
         session.pop("next", url_for(current_app.config["AUTH_LOGIN_SUCCESS_ENDPOINT"]))
     )
@@ -14,7 +14,9 @@ async def index(query_args: schemas.EventQueryString):
     if not query_args.status:
         return redirect(url_for(".index", status=enums.EventStatus.QUEUED))
     user = await current_user.get_user()
-    resultset = await actions.event.query(user, query_args.to_query())
+    resultset = await actions.event.query(
+        user, query_args.to_query(mode=enums.PaginationMode.CURSOR)
+    )
 
     subtab = query_args.status
 
@@ -24,7 +26,12 @@ async def index(query_args: schemas.EventQueryString):
 
 
 @blueprint.post("/webhook")
-async def webhook() -> str:
+async def webhook():
     data = await request.get_json()
     print("WEBHOOK POST DATA: ", data)
+
+    # batches get an answer per event id
+    if isinstance(data, list):
+        return {str(event["id"]): "OK" for event in data}
+
     return "OK"
@@ -10,7 +10,6 @@ from quart_schema import validate_querystring
 
 from quart_starter import actions, enums, schemas
 from quart_starter.lib.auth import Forbidden
-from quart_starter.lib.error import ActionError
 from quart_starter.lib.message_manager import MessageManager
 
 blueprint = Blueprint("post", __name__, template_folder="templates")
@@ -22,14 +21,19 @@ async def index(query_args: schemas.PostQueryString):
     if not query_args.status:
         return redirect(url_for(".index", status=enums.PostStatus.PUBLISHED))
     user = await current_user.get_user()
-    resultset = await actions.post.query(user, query_args.to_query(resolves=["author"]))
+    resultset = await actions.post.query(
+        user,
+        query_args.to_query(resolves=["author"], count=enums.CountStrategy.CACHED),
+    )
 
     subtab = query_args.status
     if query_args.author_id == user.id:
         subtab = f"mine-{subtab}"
 
+    liked = await actions.post.get_liked(user, [x.id for x in resultset.posts])
+
     return await render_template(
-        "post/index.html", resultset=resultset, tab="blog", subtab=subtab
+        "post/index.html", resultset=resultset, liked=liked, tab="blog", subtab=subtab
     )
 
 
@@ -40,23 +44,17 @@ async def view(id: int):
         user, id=id, options=schemas.PostGetOptions(resolves=["author"])
     )
 
-    try:
-        post_like = await actions.post.get_like(user, id)
-    except ActionError as error:
-        if error.type != "action_error.does_not_exist":
-            raise
-        post_like = None
+    liked = id in await actions.post.get_liked(user, [id])
 
-    await actions.post.view(user, id)
-    post.viewed += 1  # make sure the user sees their view
+    post = await actions.post.view(user, post)
 
     mm = MessageManager(user, f"post-{id}")
-    await mm.send_message("view", f"User {user.id} viewed page", post.viewed)
+    mm.send_latest("view", f"User {user.id} viewed page", post.viewed)
 
     can_edit = actions.post.has_permission(user, post, enums.Permission.UPDATE)
 
     return await render_template(
-        "post/view.html", post=post, post_like=post_like, can_edit=can_edit
+        "post/view.html", post=post, liked=liked, can_edit=can_edit
     )
 
 
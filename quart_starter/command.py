@@ -1,13 +1,23 @@
+import asyncio
+import datetime as dt
+import multiprocessing
+import os
+import re
 import signal
 import time
 import uuid
+from multiprocessing.connection import wait
 
 import click
 from tortoise import Tortoise, run_async
-from tortoise.transactions import in_transaction
+from tortoise.expressions import Q
 
-from quart_starter import actions, enums, schemas, settings
-from quart_starter.lib.delay_signals import DelaySignals
+from quart_starter import actions, enums, models, schemas, settings
+from quart_starter.lib.circuit_breaker import HALF_OPEN
+from quart_starter.lib.delay_signals import DrainSignals
+from quart_starter.lib.notify import PostgresListener
+from quart_starter.lib.query_plan import explain, seq_scans
+from quart_starter.lib.transaction import in_transaction
 
 
 async def atomic_action(func, *args, **kwargs):
@@ -24,12 +34,80 @@ def register_commands(app):
         run_async(atomic_action(create_post, title))
 
     @app.cli.command("process-events", help="Send out webhook events")
-    def _process_events():
-        run_async(process_events())
+    @click.option(
+        "--processes", default=1, show_default=True, help="Number of worker processes"
+    )
+    @click.option(
+        "--concurrency",
+        default=settings.WEBHOOK_CONCURRENCY,
+        show_default=True,
+        help="Webhooks in flight per process",
+    )
+    @click.option(
+        "--batch-size",
+        default=None,
+        type=int,
+        help="Events claimed at a time per process [default: concurrency]",
+    )
+    def _process_events(processes, concurrency, batch_size):
+        batch_size = batch_size or concurrency
+        if processes > 1:
+            supervise_workers(processes, concurrency, batch_size)
+        else:
+            run_worker(concurrency, batch_size)
+
+    @app.cli.command(
+        "prune-events", help="Archive processed and failed events older than a cutoff"
+    )
+    @click.option(
+        "--older-than",
+        required=True,
+        callback=parse_duration,
+        help="Age of the events to prune, like 30d, 12h or 90m",
+    )
+    @click.option(
+        "--batch-size", default=1000, show_default=True, help="Events per statement"
+    )
+    @click.option(
+        "--pause", default=0.1, show_default=True, help="Seconds between batches"
+    )
+    @click.option("--delete", is_flag=True, help="Delete instead of archiving")
+    def _prune_events(older_than, batch_size, pause, delete):
+        run_async(prune_events(older_than, batch_size, pause, delete))
+
+    @app.cli.command(
+        "check-query-plans",
+        help="Fail if a hot query can't be answered without a sequential scan",
+    )
+    @click.option(
+        "--rows",
+        default=100000,
+        show_default=True,
+        help="Posts and events seeded for the planner, rolled back afterwards",
+    )
+    def _check_query_plans(rows):
+        run_async(check_query_plans(rows))
 
     return app
 
 
+DURATION_UNITS = {
+    "s": "seconds",
+    "m": "minutes",
+    "h": "hours",
+    "d": "days",
+    "w": "weeks",
+}
+
+
+def parse_duration(_ctx, _param, value):
+    match = re.fullmatch(r"(\d+)([smhdw])", value or "")
+    if not match:
+        raise click.BadParameter("expected a number followed by s, m, h, d or w")
+
+    return dt.timedelta(**{DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+
 async def create_post(title):
     system_user = await actions.user.system_user()
     post = await actions.post.create(
@@ -44,40 +122,353 @@ async def create_post(title):
     print(f"Created Post: {post.title} (ID: {post.id})")
 
 
-async def process_events():
+def supervise_workers(num_processes, concurrency, batch_size):
+    """
+    Runs `num_processes` event workers, restarting any that die, until SIGINT or
+    SIGTERM.  Those are forwarded to the workers, which drain before exiting.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = {}
+    stopping = []
+
+    def start_worker(slot):
+        process = context.Process(
+            target=run_worker,
+            args=(concurrency, batch_size),
+            name=f"process-events-{slot}",
+        )
+        process.start()
+        workers[slot] = process
+
+    def stop(signum, _frame):
+        stopping.append(signum)
+        for process in workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for slot in range(num_processes):
+        start_worker(slot)
+
+    while workers:
+        wait([process.sentinel for process in workers.values()], timeout=1)
+
+        for slot, process in list(workers.items()):
+            if process.is_alive():
+                continue
+
+            del workers[slot]
+            if not stopping:
+                print(f"Worker {process.name} exited ({process.exitcode}), restarting")
+                time.sleep(1)
+                start_worker(slot)
+
+
+def run_worker(concurrency, batch_size):
+    run_async(process_events(concurrency, batch_size))
+
+
+async def wait_for_any(*aws):
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def process_events(concurrency, batch_size):
     worker_id = str(uuid.uuid4())
 
     await Tortoise.init(config=settings.TORTOISE_ORM)
 
+    actions.event.dispatcher.concurrency = concurrency
+
     system_user = await actions.user.system_user()
 
-    WORKER_QUEUE_SIZE = 5
+    async def deliver(event):
+        try:
+            return await actions.event.send_webhook(event)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # the lease is renewed while we run, so release it for the retry
+            print(f"ERROR: {e}, continuing")
+            return actions.event.abandon_attempt(event, e)
 
-    while True:
-        await actions.event.reset_abandoned(system_user)
+    async def renew_leases():
+        while True:
+            await asyncio.sleep(settings.EVENT_LEASE_DURATION / 3)
+            try:
+                await actions.event.renew_leases(
+                    system_user, worker_id, lease=settings.EVENT_LEASE_DURATION
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"ERROR: renewing leases failed: {e}")
+
+    listener = PostgresListener(actions.event.QUEUED_CHANNEL)
+    renewer = asyncio.create_task(renew_leases())
+
+    try:
+        await listener.connect()
 
-        events = await actions.event.reserved_for_worker(system_user, worker_id)
+        with DrainSignals(unless_repeated_n_times=5) as signals:
+            while not signals.received.is_set():
+                # nothing is claimed while the receiver is known to be down, so an
+                # outage doesn't turn into writes for every event that comes due
+                permit = await actions.event.check_breaker(system_user)
+                if not permit.allowed:
+                    print(f"Webhooks paused, waiting {permit.retry_after:.1f}s...")
+                    await wait_for_any(
+                        asyncio.sleep(permit.retry_after), signals.received.wait()
+                    )
+                    continue
 
-        limit = max(0, WORKER_QUEUE_SIZE - len(events))
+                # a half-open breaker lets a single event through as the probe
+                limit = 1 if permit.state == HALF_OPEN else batch_size
+
+                events = await actions.event.reserve_for_worker(
+                    system_user,
+                    worker_id,
+                    limit=limit,
+                    lease=settings.EVENT_LEASE_DURATION,
+                )
+                claimed = len(events)
 
-        if limit > 0:
-            async with in_transaction():
-                await actions.event.reserve_for_worker(
-                    system_user, worker_id, limit=limit
+                events = await actions.event.start_attempts(
+                    system_user, worker_id, [event.id for event in events]
                 )
 
-            events = await actions.event.reserved_for_worker(system_user, worker_id)
+                print(f"Processing {len(events)} events")
+                # deliveries run concurrently, the dispatcher caps how many at once
+                outcomes = await asyncio.gather(*[deliver(event) for event in events])
 
-        print(f"Processing {len(events)} events")
-        for event in events:
-            with DelaySignals(signal.SIGINT, unless_repeated_n_times=5):
                 try:
-                    async with in_transaction():
-                        await actions.event.worker_webhook(
-                            system_user, event.id, worker_id
-                        )
+                    await actions.event.save_outcomes(system_user, worker_id, outcomes)
                 except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"ERROR: {e}, continuing")
+                    print(f"ERROR: saving outcomes failed: {e}, continuing")
+
+                    # the attempts were counted and their retries scheduled, hand
+                    # the events back instead of holding them until we exit
+                    try:
+                        await actions.event.release_for_worker(system_user, worker_id)
+                    except Exception as error:  # pylint: disable=broad-exception-caught
+                        print(f"ERROR: releasing events failed: {error}")
+
+                if claimed == batch_size:
+                    continue  # there is likely more due right away
+
+                timeout = await actions.event.next_attempt_delay(
+                    system_user, settings.EVENT_POLL_INTERVAL
+                )
+                print(f"Waiting up to {timeout:.1f}s...")
+                await wait_for_any(listener.wait(timeout), signals.received.wait())
+    finally:
+        renewer.cancel()
+
+        # hand back whatever was claimed but not delivered, rather than leaving it
+        # for the lease to expire
+        released = await actions.event.release_for_worker(system_user, worker_id)
+        print(f"Released {released} events")
+
+        await listener.close()
+        await actions.event.dispatcher.close()
+
+
+async def prune_events(older_than, batch_size, pause, delete):
+    await Tortoise.init(config=settings.TORTOISE_ORM)
+
+    system_user = await actions.user.system_user()
+
+    cutoff = dt.datetime.now(dt.timezone.utc) - older_than
+    total = 0
+
+    while True:
+        pruned = await actions.event.prune(
+            system_user, cutoff, archive=not delete, batch_size=batch_size
+        )
+        total += pruned
+        print(f"{'Deleted' if delete else 'Archived'} {total} events")
+
+        if pruned < batch_size:
+            break
+
+        # leave room for the workers between batches
+        await asyncio.sleep(pause)
+
+
+# a dataset shaped like production, so the planner weighs the same choices
+QUERY_PLAN_SEED_SQL = [
+    """
+    INSERT INTO "user" ("email", "name", "role")
+    SELECT 'query-plan-' || i || '@example.com', 'Query Plan ' || i, 'user'
+    FROM generate_series(1, GREATEST($1 / 100, 1)) AS i
+    """,
+    """
+    WITH users AS (
+        SELECT array_agg("id") AS ids FROM "user" WHERE "email" LIKE 'query-plan-%'
+    )
+    INSERT INTO "post" (
+        "title", "status", "content", "published_at", "author_id", "created_at"
+    )
+    SELECT
+        'Post ' || i,
+        CASE WHEN i % 10 = 0 THEN 'draft' ELSE 'published' END,
+        'Content',
+        CASE WHEN i % 10 = 0 THEN NULL ELSE NOW() - i * INTERVAL '1 minute' END,
+        ids[1 + i % array_length(ids, 1)],
+        NOW() - i * INTERVAL '1 minute'
+    FROM users, generate_series(1, $1) AS i
+    """,
+    """
+    INSERT INTO "postlike" ("post_id", "user_id")
+    SELECT "id", "author_id" FROM "post" ORDER BY "id" DESC LIMIT $1
+    ON CONFLICT ("post_id", "user_id") DO NOTHING
+    """,
+    """
+    INSERT INTO "event" (
+        "name", "data", "status", "num_attempts", "next_attempt_at", "created_at"
+    )
+    SELECT
+        'query-plan',
+        '{}',
+        CASE
+            WHEN i % 20 = 0 THEN 'queued'
+            WHEN i % 50 = 1 THEN 'failed'
+            ELSE 'processed'
+        END,
+        1,
+        NOW() + (i % 600) * INTERVAL '1 second',
+        NOW() - i * INTERVAL '1 minute'
+    FROM generate_series(1, $1) AS i
+    """,
+    """
+    WITH users AS (
+        SELECT array_agg("id") AS ids FROM "user" WHERE "email" LIKE 'query-plan-%'
+    )
+    INSERT INTO "token" ("name", "auth_id", "user_id")
+    SELECT 'Token ' || i, 'query-plan-' || i, ids[1 + i % array_length(ids, 1)]
+    FROM users, generate_series(1, $1 / 10) AS i
+    """,
+]
+
+
+def query_plan_checks(user: schemas.User, admin: schemas.User):
+    """
+    The statements behind the hot paths in actions, as the actions issue them.
+    """
+    now = dt.datetime.now(dt.timezone.utc)
+    queued = enums.EventStatus.QUEUED.value
+    worker_id = str(uuid.uuid4())
+
+    def post_page(user, **kwargs):
+        q = schemas.PostQueryString(**kwargs).to_query(
+            resolves=["author"], count=enums.CountStrategy.CACHED
+        )
+        return q.page_queryset(actions.post.visible_to(user)).sql()
+
+    def event_page(**kwargs):
+        q = schemas.EventQueryString(**kwargs).to_query(
+            mode=enums.PaginationMode.CURSOR
+        )
+        return q.page_queryset(actions.event.visible_to(admin)).sql()
+
+    return [
+        (
+            "event.reserve_for_worker",
+            actions.event.RESERVE_SQL,
+            [worker_id, 10, 60],
+        ),
+        ("event.renew_leases", actions.event.RENEW_SQL, [worker_id, 60]),
+        (
+            "event.release_for_worker",
+            models.Event.filter(status=queued, worker_id=worker_id).sql(),
+            None,
+        ),
+        (
+            "event.next_attempt_delay",
+            models.Event.filter(
+                Q(worker_id__isnull=True) | Q(lease_expires_at__lt=now),
+                status=queued,
+            )
+            .order_by("next_attempt_at")
+            .limit(1)
+            .sql(),
+            None,
+        ),
+        (
+            "event.prune",
+            actions.event.PRUNE_SQL,
+            [now - dt.timedelta(days=30), 1000, True],
+        ),
+        ("event.query", event_page(status=enums.EventStatus.PROCESSED), None),
+        (
+            "post.query",
+            post_page(user, status=enums.PostStatus.PUBLISHED),
+            None,
+        ),
+        (
+            "post.query mine",
+            post_page(user, status=enums.PostStatus.DRAFT, author_id=user.id),
+            None,
+        ),
+        ("post.query any status", post_page(user), None),
+        (
+            "post.query admin",
+            post_page(admin, status=enums.PostStatus.PUBLISHED),
+            None,
+        ),
+        (
+            "post.get_liked",
+            models.PostLike.filter(user_id=user.id, post_id__in=[1, 2, 3]).sql(),
+            None,
+        ),
+        (
+            "post.like",
+            actions.post.LIKE_SQL,
+            [1, user.id, enums.PostStatus.PUBLISHED.value, False],
+        ),
+        ("post.unlike", actions.post.UNLIKE_SQL, [1, user.id]),
+        (
+            "token.query",
+            schemas.TokenQueryString()
+            .to_query()
+            .page_queryset(actions.token.visible_to(user))
+            .sql(),
+            None,
+        ),
+    ]
+
+
+async def check_query_plans(rows):
+    await Tortoise.init(config=settings.TORTOISE_ORM)
+
+    failures = 0
+
+    async with in_transaction() as connection:
+        # seeded inside the transaction and rolled back, so nothing is left behind
+        for sql in QUERY_PLAN_SEED_SQL:
+            await connection.execute_query(sql, [rows])
+        await connection.execute_script(
+            'ANALYZE "user", "post", "postlike", "event", "token"'
+        )
+
+        user = schemas.User.model_validate(
+            await models.User.filter(email__startswith="query-plan-")
+            .using_db(connection)
+            .first()
+        )
+        admin = user.model_copy(update={"role": enums.UserRole.ADMIN})
+
+        for name, sql, values in query_plan_checks(user, admin):
+            relations = seq_scans(await explain(connection, sql, values))
+            if relations:
+                failures += 1
+                print(f"SEQ SCAN  {name}: {', '.join(relations)}")
+            else:
+                print(f"ok        {name}")
+
+        await connection.rollback()
 
-        print("Sleeping...")
-        time.sleep(5)
+    if failures:
+        raise click.ClickException(f"{failures} queries need a sequential scan")
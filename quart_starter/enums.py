@@ -38,3 +38,16 @@ class EventStatus(EnumStr):
     QUEUED = "queued"
     PROCESSED = "processed"
     FAILED = "failed"
+
+
+class PaginationMode(EnumStr):
+    OFFSET = "offset"
+    CURSOR = "cursor"
+
+
+class CountStrategy(EnumStr):
+    EXACT = "exact"
+    WINDOW = "window"
+    CACHED = "cached"
+    ESTIMATED = "estimated"
+    NONE = "none"
@@ -1,4 +1,5 @@
 import json
+import time
 from functools import wraps
 from typing import Any, Callable
 
@@ -6,12 +7,41 @@ from quart import current_app, session
 from quart_auth import AuthUser as _AuthUser
 from quart_auth import Unauthorized, current_user
 
-from quart_starter import actions, schemas
+from quart_starter import actions, schemas, settings
 
+from . import session_token
+from .cache import TTLCache, invalidator
 from .error import ActionError
 
 ANONYMOUS_USER = "anonymous_user"
 
+auth_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+
+def invalidate_auth_cache(payload: dict) -> None:
+    if "auth_id" in payload:
+        auth_cache.pop(payload["auth_id"])
+
+    if "user_id" in payload:
+        auth_cache.evict(lambda _, value: value[1].id == payload["user_id"])
+
+    session_token.revoke(auth_id=payload.get("auth_id"), user_id=payload.get("user_id"))
+
+
+def resync_auth_cache() -> None:
+    # revocations may have been missed while the listener was disconnected
+    auth_cache.clear()
+    session_token.distrust_issued_before(time.time())
+
+
+def login_auth_id(token: schemas.TokenCreateSuccess, user: schemas.User) -> str:
+    if settings.SESSION_TOKEN_STATELESS:
+        return session_token.dump(token, user)
+    return token.auth_id
+
+
+invalidator.register("auth", invalidate_auth_cache, resync=resync_auth_cache)
+
 
 class Forbidden(Exception):
     pass
@@ -27,9 +57,23 @@ class AuthUser(_AuthUser):
     async def _resolve(self):
         if not self._resolved:
             system_user = schemas.User.system_user()
+            auth_id = self.auth_id
             try:
-                self._token = await actions.token.get(system_user, auth_id=self.auth_id)
-                self._user = await actions.user.get(system_user, id=self._token.user_id)
+                stateless = session_token.load(auth_id)
+                if stateless:
+                    auth_id = stateless.auth_id
+
+                cached = auth_cache.get(auth_id) if auth_id else None
+                if stateless and stateless.trusted:
+                    self._token, self._user = stateless.token, stateless.user
+                elif cached:
+                    self._token, self._user = cached
+                else:
+                    self._token = await actions.token.get(system_user, auth_id=auth_id)
+                    self._user = await actions.user.get(
+                        system_user, id=self._token.user_id
+                    )
+                    auth_cache.set(auth_id, (self._token, self._user))
                 session.pop(ANONYMOUS_USER, None)
             except ActionError as error:
                 if error.type not in ("action_error.not_found", "action_error.does_not_exist"):
@@ -0,0 +1,38 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        """
+        A fixed size probabilistic set.  Membership tests may return false positives
+        at roughly `error_rate` once `capacity` items were added, but never false
+        negatives.
+
+        Args:
+            capacity (int): Expected number of items.
+            error_rate (float): Acceptable false positive rate at capacity.
+        """
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.num_bits / 8))
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
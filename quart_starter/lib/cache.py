@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from .pubsub import PUBSUB_ERRORS, PubSubManager
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache-invalidation"
+
+# invalidations held back by `CacheInvalidator.deferred` in the current task
+_deferred: ContextVar[Optional[list]] = ContextVar(
+    "deferred_invalidations", default=None
+)
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        """
+        A bounded, least recently used cache whose entries expire after `ttl` seconds.
+
+        Args:
+            maxsize (int): Maximum number of entries held before the oldest is evicted.
+            ttl (float): Number of seconds an entry is considered fresh.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def items(self):
+        now = time.monotonic()
+        return [
+            (k, v) for k, (expires_at, v) in self._data.items() if expires_at >= now
+        ]
+
+    def evict(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class CacheInvalidator:
+    def __init__(self):
+        """
+        Broadcasts cache invalidations to every process sharing the same PubSub backend.
+
+        Handlers are registered by name and called with the JSON payload passed to
+        `invalidate`, both locally and on every other node that receives the message.
+        """
+        self.handlers: Dict[str, Callable[[dict], None]] = {}
+        self.resync_handlers: List[Callable[[], None]] = []
+        self.pubsub_client: Optional[PubSubManager] = None
+
+    def register(
+        self,
+        name: str,
+        handler: Callable[[dict], None],
+        resync: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Args:
+            name (str): Name passed to `invalidate`.
+            handler (Callable): Called with the payload of every invalidation.
+            resync (Callable): Called whenever the listener (re)connects, since
+                invalidations published while it was disconnected are lost.
+        """
+        self.handlers[name] = handler
+        if resync is not None:
+            self.resync_handlers.append(resync)
+
+    def _dispatch(self, name: str, payload: dict) -> None:
+        handler = self.handlers.get(name)
+        if handler:
+            handler(payload)
+
+    async def invalidate(self, name: str, payload: dict) -> None:
+        """
+        Invalidates entries in this process and publishes the invalidation to the others.
+
+        Args:
+            name (str): Name the handler was registered with.
+            payload (dict): JSON serializable description of what to invalidate.
+        """
+        deferred = _deferred.get()
+        if deferred is not None:
+            deferred.append((name, payload))
+            return
+
+        self._dispatch(name, payload)
+
+        if self.pubsub_client is None:
+            return
+
+        try:
+            await self.pubsub_client.connect()
+            await self.pubsub_client.publish(
+                INVALIDATION_CHANNEL, json.dumps({"name": name, "payload": payload})
+            )
+        except PUBSUB_ERRORS as error:
+            logger.warning("unable to publish cache invalidation: %s", error)
+
+    @asynccontextmanager
+    async def deferred(self):
+        """
+        Holds back invalidations made inside the block until it exits without error.
+
+        Wrap transactions with this so other requests can't re-cache the old rows
+        between the invalidation and the commit. Invalidations are dropped if the
+        block raises, since its transaction was rolled back.
+        """
+        pending = []
+        token = _deferred.set(pending)
+        try:
+            yield
+        finally:
+            _deferred.reset(token)
+
+        for name, payload in pending:
+            await self.invalidate(name, payload)
+
+    async def listen(self) -> None:
+        """
+        Applies invalidations published by other processes until cancelled.
+        """
+        while True:
+            try:
+                await self.pubsub_client.connect()
+                pubsub_subscriber = await self.pubsub_client.subscribe(
+                    INVALIDATION_CHANNEL
+                )
+                for resync in self.resync_handlers:
+                    resync()
+
+                while True:
+                    message = await pubsub_subscriber.get_message(
+                        ignore_subscribe_messages=True, timeout=None
+                    )
+                    if message is not None:
+                        data = json.loads(message["data"])
+                        self._dispatch(data["name"], data["payload"])
+            except PUBSUB_ERRORS as error:
+                logger.warning("cache invalidation listener failed: %s", error)
+                await asyncio.sleep(5)
+
+
+invalidator = CacheInvalidator()
@@ -0,0 +1,151 @@
+import logging
+import time
+from typing import Dict, NamedTuple, Tuple
+
+from redis.exceptions import RedisError
+
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# returns {state, milliseconds until it is worth asking again}
+ALLOW_SCRIPT = """
+local open_ttl = redis.call("PTTL", KEYS[1])
+if open_ttl > 0 then
+    return {0, open_ttl}
+end
+local failures = tonumber(redis.call("GET", KEYS[2]) or "0")
+if failures < tonumber(ARGV[1]) then
+    return {1, 0}
+end
+if redis.call("SET", KEYS[3], "1", "NX", "PX", ARGV[2]) then
+    return {2, 0}
+end
+return {0, math.max(redis.call("PTTL", KEYS[3]), 0)}
+"""
+
+FAILURE_SCRIPT = """
+local failures = redis.call("INCR", KEYS[2])
+redis.call("PEXPIRE", KEYS[2], ARGV[3])
+if failures >= tonumber(ARGV[1]) then
+    redis.call("SET", KEYS[1], "1", "PX", ARGV[2])
+    redis.call("DEL", KEYS[3])
+end
+return failures
+"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Permit(NamedTuple):
+    state: str
+    retry_after: float
+
+    @property
+    def allowed(self) -> bool:
+        return self.state != OPEN
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        probe_timeout: float = 10,
+    ):
+        """
+        A circuit breaker per destination, shared through Redis so every process
+        backs off together, with an in-process fallback.
+
+        After `failure_threshold` consecutive failures the breaker opens for
+        `reset_timeout` seconds.  It then lets a single probe through (half-open),
+        a success closes it again and a failure re-opens it.
+
+        Args:
+            name (str): Prefix for the Redis keys.
+            failure_threshold (int): Consecutive failures that open the breaker.
+            reset_timeout (float): Seconds the breaker stays open.
+            probe_timeout (float): Seconds a probe may take before another is allowed.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self._allow_script = None
+        self._failure_script = None
+        # destination => (failures, open until, probing until)
+        self._local: Dict[str, Tuple[int, float, float]] = {}
+
+    def _keys(self, destination: str):
+        prefix = f"{self.name}:{destination}"
+        return [f"{prefix}:open", f"{prefix}:failures", f"{prefix}:probe"]
+
+    def _allow_local(self, destination: str) -> Permit:
+        now = time.monotonic()
+        failures, open_until, probing_until = self._local.get(destination, (0, 0, 0))
+
+        if open_until > now:
+            return Permit(OPEN, open_until - now)
+        if failures < self.failure_threshold:
+            return Permit(CLOSED, 0)
+        if probing_until > now:
+            return Permit(OPEN, probing_until - now)
+
+        self._local[destination] = (failures, 0, now + self.probe_timeout)
+        return Permit(HALF_OPEN, 0)
+
+    async def allow(self, destination: str) -> Permit:
+        """
+        Asks whether a request to `destination` may go out.
+
+        Returns:
+            Permit: Closed or half-open (this caller is the probe) when allowed,
+                otherwise open with the seconds to wait before asking again.
+        """
+        try:
+            if self._allow_script is None:
+                self._allow_script = get_redis().register_script(ALLOW_SCRIPT)
+
+            state, retry_after = await self._allow_script(
+                keys=self._keys(destination),
+                args=[self.failure_threshold, int(self.probe_timeout * 1000)],
+            )
+            return Permit([OPEN, CLOSED, HALF_OPEN][state], retry_after / 1000)
+        except RedisError as error:
+            logger.warning("%s falling back to local state: %s", self.name, error)
+            return self._allow_local(destination)
+
+    async def record_success(self, destination: str) -> None:
+        self._local.pop(destination, None)
+
+        try:
+            await get_redis().delete(*self._keys(destination)[1:])
+        except RedisError as error:
+            logger.warning("unable to record %s success: %s", self.name, error)
+
+    async def record_failure(self, destination: str) -> None:
+        now = time.monotonic()
+        failures, open_until, _ = self._local.get(destination, (0, 0, 0))
+        failures += 1
+        if failures >= self.failure_threshold:
+            open_until = now + self.reset_timeout
+        self._local[destination] = (failures, open_until, 0)
+
+        try:
+            if self._failure_script is None:
+                self._failure_script = get_redis().register_script(FAILURE_SCRIPT)
+
+            await self._failure_script(
+                keys=self._keys(destination),
+                args=[
+                    self.failure_threshold,
+                    int(self.reset_timeout * 1000),
+                    # failures only count as consecutive while they keep coming
+                    int(self.reset_timeout * 10 * 1000),
+                ],
+            )
+        except RedisError as error:
+            logger.warning("unable to record %s failure: %s", self.name, error)
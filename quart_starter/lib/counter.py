@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict
+
+from redis.exceptions import RedisError
+
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedCounter:
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[Dict[int, int]], Awaitable[None]],
+        interval: float = 5,
+        threshold: int = 1000,
+    ):
+        """
+        Accumulates increments in a Redis hash (or in process when Redis is down) and
+        writes them back in batches.
+
+        Args:
+            name (str): Redis key of the hash holding pending increments.
+            flush (Callable): Coroutine persisting a {key: amount} mapping.
+            interval (float): Seconds between flushes.
+            threshold (int): Number of increments in this process that triggers an
+                early flush.
+        """
+        self.name = name
+        self.flush_func = flush
+        self.interval = interval
+        self.threshold = threshold
+        self.local: Dict[int, int] = defaultdict(int)
+        self.num_increments = 0
+        self._wakeup = asyncio.Event()
+
+    async def incr(self, key: int, amount: int = 1) -> int:
+        """
+        Records an increment.
+
+        Returns:
+            int: Amount pending for `key` that is not yet persisted, including this one.
+        """
+        try:
+            pending = await get_redis().hincrby(self.name, key, amount)
+        except RedisError as error:
+            logger.warning("%s falling back to local buffer: %s", self.name, error)
+            self.local[key] += amount
+            pending = self.local[key]
+
+        self.num_increments += 1
+        if self.num_increments >= self.threshold:
+            self._wakeup.set()
+
+        return pending
+
+    async def pending(self, key: int) -> int:
+        try:
+            pending = int(await get_redis().hget(self.name, key) or 0)
+        except RedisError:
+            pending = 0
+        return pending + self.local.get(key, 0)
+
+    async def _take_redis(self) -> Dict[int, int]:
+        # MULTI/EXEC reads and deletes the hash in one step, so there is no window
+        # where a failure leaves the increments under a key no one flushes
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hgetall(self.name)
+            pipe.delete(self.name)
+            data, _ = await pipe.execute()
+
+        return {int(k): int(v) for k, v in data.items()}
+
+    async def flush(self) -> None:
+        counts = self.local
+        self.local = defaultdict(int)
+        self.num_increments = 0
+        self._wakeup.clear()
+
+        try:
+            for key, amount in (await self._take_redis()).items():
+                counts[key] += amount
+        except RedisError as error:
+            logger.warning("unable to drain %s: %s", self.name, error)
+
+        if not counts:
+            return
+
+        try:
+            await self.flush_func(dict(counts))
+        except Exception:
+            # keep the increments around for the next attempt
+            for key, amount in counts.items():
+                self.local[key] += amount
+            raise
+
+    async def run(self) -> None:
+        """
+        Flushes every `interval` seconds, or sooner once `threshold` is reached, until
+        cancelled.  Pending increments are flushed one last time on cancellation.
+        """
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                try:
+                    await self.flush()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.error("flushing %s failed: %s", self.name, e)
+        finally:
+            await self.flush()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import signal
 
@@ -65,3 +66,69 @@ class DelaySignals:
                 logging.warn(
                     f"{__class__.__name__}: Signal {sig} had no prior handler, skipping."
                 )
+
+
+class DrainSignals:
+    def __init__(
+        self,
+        signals_to_delay: list[signal.Signals] = (signal.SIGINT, signal.SIGTERM),
+        unless_repeated_n_times: int = False,
+    ):
+        """
+        The asyncio counterpart of DelaySignals for long running loops.  Instead of
+        interrupting, the chosen signals set `received` so the loop can finish the work
+        in flight and exit on its own.
+
+        Args:
+            signals_to_delay (list[signal.Signals], optional): The signal or
+                list/tuple of signals to delay. Defaults to SIGINT and SIGTERM.
+            unless_repeated_n_times (int|bool, optional): If a signal is received N
+                amount of times, cancel the task that entered the scope. Defaults to
+                False.
+
+        Example usage:
+            ```py
+            with DrainSignals() as signals:
+                while not signals.received.is_set():
+                    await do_work()
+            ```
+        """
+        self.signals_to_delay = (
+            signals_to_delay
+            if type(signals_to_delay) in [list, tuple]
+            else [signals_to_delay]
+        )
+        self.unless_repeated_n_times = unless_repeated_n_times
+        self.received = asyncio.Event()
+        self.num_received = 0
+        self.task = None
+
+    def __enter__(self):
+        self.task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig_type in self.signals_to_delay:
+            loop.add_signal_handler(sig_type, self.signal_handler, sig_type)
+        return self
+
+    def signal_handler(self, sig):
+        self.num_received += 1
+        self.received.set()
+
+        if (
+            self.unless_repeated_n_times
+            and self.num_received >= self.unless_repeated_n_times
+        ):
+            logging.warning(
+                "%s: Signal %s repeated enough times (%s) to pass through, cancelling.",
+                __class__.__name__,
+                sig,
+                self.unless_repeated_n_times,
+            )
+            self.task.cancel()
+        else:
+            logging.info("%s: Signal %s received, draining.", __class__.__name__, sig)
+
+    def __exit__(self, *_):
+        loop = asyncio.get_running_loop()
+        for sig_type in self.signals_to_delay:
+            loop.remove_signal_handler(sig_type)
@@ -9,3 +9,8 @@ class ActionError(ValueError):
 class ForbiddenActionError(ActionError):
     def __init__(self, loc=None, type="forbidden"):
         super().__init__("Action Denied", loc=loc, type=type)
+
+
+class RateLimitedActionError(ActionError):
+    def __init__(self, loc=None, type="rate_limited"):
+        super().__init__("Too Many Requests", loc=loc, type=type)
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import logging
+import math
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from .cache import TTLCache
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# marks the key dirty and adds the item, unless the key has to be restored first
+ADD_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return -1
+end
+redis.call("PFADD", KEYS[1], ARGV[1])
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+redis.call("SADD", KEYS[2], ARGV[3])
+return redis.call("PFCOUNT", KEYS[1])
+"""
+
+
+class HyperLogLog:
+    def __init__(self, precision: int = 12):
+        """
+        In process cardinality estimator with a standard error of about
+        1.04 / sqrt(2 ** precision).
+        """
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+
+    def add(self, item: str) -> None:
+        x = int.from_bytes(
+            hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        self.registers[index] = max(self.registers[index], rank)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return round(estimate)
+
+
+class UniqueCounter:
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[int], Awaitable[Optional[bytes]]],
+        snapshot: Callable[[Dict[int, Tuple[int, Optional[bytes]]]], Awaitable[None]],
+        interval: float = 60,
+        ttl: int = 86400,
+    ):
+        """
+        Counts unique items per key with Redis HyperLogLogs, falling back to an in
+        process estimator while Redis is unavailable.
+
+        Sketches that were touched get snapshotted into the database every `interval`
+        seconds, so Redis can expire cold keys after `ttl` seconds and restore them
+        from the snapshot on the next add.
+
+        Args:
+            name (str): Prefix for the Redis keys.
+            load (Callable): Coroutine returning the persisted sketch for a key.
+            snapshot (Callable): Coroutine persisting {key: (count, sketch)}.
+        """
+        self.name = name
+        self.load = load
+        self.snapshot_func = snapshot
+        self.interval = interval
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=10000, ttl=ttl)
+        self._script = None
+
+    def _key(self, key: int) -> str:
+        return f"{self.name}:{key}"
+
+    @property
+    def _dirty_key(self) -> str:
+        return f"{self.name}:dirty"
+
+    async def add(self, key: int, item: str) -> int:
+        """
+        Adds `item` to the set for `key`.
+
+        Returns:
+            int: Estimated number of unique items, this one included.
+        """
+        try:
+            if self._script is None:
+                self._script = get_redis().register_script(ADD_SCRIPT)
+
+            count = await self._script(
+                keys=[self._key(key), self._dirty_key], args=[item, self.ttl, key]
+            )
+            if count >= 0:
+                return count
+
+            sketch = await self.load(key)
+            async with get_redis().pipeline(transaction=True) as pipe:
+                if sketch:
+                    pipe.set(self._key(key), sketch, nx=True)
+                pipe.pfadd(self._key(key), item)
+                pipe.expire(self._key(key), self.ttl)
+                pipe.sadd(self._dirty_key, key)
+                pipe.pfcount(self._key(key))
+                return (await pipe.execute())[-1]
+        except RedisError as error:
+            logger.warning("%s falling back to local estimator: %s", self.name, error)
+
+        hll = self.local.get(key)
+        if hll is None:
+            hll = HyperLogLog()
+            self.local.set(key, hll)
+        hll.add(item)
+        return hll.count()
+
+    async def _read_dirty(
+        self, batch_size: int
+    ) -> Tuple[List[int], Dict[int, Tuple[int, bytes]]]:
+        popped = await get_redis().spop(self._dirty_key, batch_size)
+        keys = [int(key) for key in popped or []]
+        if not keys:
+            return keys, {}
+
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.pfcount(self._key(key))
+                    pipe.get(self._key(key))
+                results = await pipe.execute()
+        except RedisError:
+            await self._mark_dirty(keys)
+            raise
+
+        return keys, {
+            key: (count, sketch)
+            for key, count, sketch in zip(keys, results[::2], results[1::2])
+            if sketch
+        }
+
+    async def _mark_dirty(self, keys) -> None:
+        if not keys:
+            return
+
+        try:
+            await get_redis().sadd(self._dirty_key, *keys)
+        except RedisError as error:
+            logger.warning("unable to requeue %s sketches: %s", self.name, error)
+
+    def _restore_local(self, local) -> None:
+        for key, hll in local:
+            current = self.local.get(key)
+            if current is not None:
+                # items were added while the snapshot was being written
+                hll.merge(current)
+            self.local.set(key, hll)
+
+    async def snapshot(self, batch_size: int = 500) -> None:
+        """
+        Persists every touched sketch, `batch_size` keys per Redis round trip and
+        `snapshot` call.  Keys whose snapshot failed are marked dirty again.
+        """
+        local = self.local.items()
+        self.local.clear()
+        snapshots = {key: (hll.count(), None) for key, hll in local}
+
+        while True:
+            try:
+                keys, dirty = await self._read_dirty(batch_size)
+            except RedisError as error:
+                logger.warning("unable to read %s sketches: %s", self.name, error)
+                keys, dirty = [], {}
+
+            snapshots.update(dirty)
+            if snapshots:
+                try:
+                    await self.snapshot_func(snapshots)
+                except Exception:
+                    await self._mark_dirty(keys)
+                    self._restore_local(local)
+                    raise
+
+            if len(keys) < batch_size:
+                break
+
+            local, snapshots = [], {}
+
+    async def run(self) -> None:
+        """
+        Snapshots touched sketches every `interval` seconds until cancelled.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+
+                try:
+                    await self.snapshot()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.error("snapshotting %s failed: %s", self.name, e)
+        finally:
+            await self.snapshot()
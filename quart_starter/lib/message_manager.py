@@ -44,7 +44,7 @@ class MessageManager:
     def __await__(self):
         return self.__aenter__().__await__()
 
-    async def send_message(self, msg_type: str, message: str, data: Any = None):
+    def _build_message(self, msg_type: str, message: str, data: Any = None) -> str:
         message = {
             "session_id": self.session_id,
             "user_id": self.user.id,
@@ -56,6 +56,18 @@ class MessageManager:
         if data is not None:
             message["data"] = data
 
+        return json.dumps(message)
+
+    async def send_message(self, msg_type: str, message: str, data: Any = None):
         await current_app.socket_manager.broadcast_to_channel(
-            self.channel_id, json.dumps(message)
+            self.channel_id, self._build_message(msg_type, message, data)
+        )
+
+    def send_latest(self, msg_type: str, message: str, data: Any = None):
+        """
+        Sends the message in the background, replacing any message of the same type
+        still waiting in this channel's coalesce window.
+        """
+        current_app.socket_manager.broadcast_latest(
+            self.channel_id, msg_type, self._build_message(msg_type, message, data)
         )
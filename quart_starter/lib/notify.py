@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+from tortoise import connections
+
+logger = logging.getLogger(__name__)
+
+
+async def notify(channel: str, payload: str = "", connection_name="default") -> None:
+    """
+    Sends a Postgres NOTIFY, inside a transaction it is delivered on commit.
+    """
+    await connections.get(connection_name).execute_query(
+        "SELECT pg_notify($1, $2)", [channel, payload]
+    )
+
+
+class PostgresListener:
+    def __init__(self, channel: str, connection_name: str = "default"):
+        """
+        Waits for Postgres notifications on `channel` using a dedicated connection,
+        since a pooled connection could be handed to someone else between waits.
+
+        Args:
+            channel (str): Channel to LISTEN on.
+            connection_name (str): Tortoise connection whose credentials are used.
+        """
+        self.channel = channel
+        self.connection_name = connection_name
+        self._connection: Optional[asyncpg.Connection] = None
+        self._notified = asyncio.Event()
+
+    def _on_notification(self, *_) -> None:
+        self._notified.set()
+
+    async def connect(self) -> None:
+        if self._connection is not None and not self._connection.is_closed():
+            return
+
+        client = connections.get(self.connection_name)
+        self._connection = await asyncpg.connect(
+            host=client.host,
+            port=client.port,
+            user=client.user,
+            password=client.password,
+            database=client.database,
+        )
+        await self._connection.add_listener(self.channel, self._on_notification)
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for a notification.  Notifications received
+        since the last wait return immediately, so none are lost while busy.
+
+        Returns:
+            bool: Whether a notification arrived, False when the timeout expired.
+        """
+        try:
+            await self.connect()
+        except (OSError, asyncpg.PostgresError) as error:
+            # keep polling on the timeout until the connection comes back
+            logger.warning("unable to listen on %s: %s", self.channel, error)
+
+        try:
+            await asyncio.wait_for(self._notified.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._notified.clear()
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
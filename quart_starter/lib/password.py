@@ -0,0 +1,86 @@
+import asyncio
+import base64
+import hashlib
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+import bcrypt
+
+from quart_starter import settings
+
+
+def _prehash(password: str) -> bytes:
+    # bcrypt only looks at the first 72 bytes, so feed it a fixed length digest
+    return base64.b64encode(hashlib.sha256(password.encode("utf-8")).digest())
+
+
+def _hashpw(password: str, rounds: int) -> bytes:
+    return bcrypt.hashpw(_prehash(password), bcrypt.gensalt(rounds=rounds))
+
+
+def _checkpw(password: str, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(_prehash(password), hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, pool: str = "thread"):
+        """
+        Runs bcrypt on a dedicated executor so hashing never blocks the event loop.
+
+        Args:
+            rounds (int): bcrypt work factor used for new hashes.
+            max_workers (int): Number of threads or processes doing the hashing.
+            pool (str): "thread" or "process".
+        """
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.pool = pool
+        self.in_flight = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="password"
+                )
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of hashing jobs waiting for a free worker.
+        """
+        return max(0, self.in_flight - self.max_workers)
+
+    async def _run(self, func, *args):
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, func, *args
+            )
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> bytes:
+        return await self._run(_hashpw, password, self.rounds)
+
+    async def check(self, password: str, hashed_password: bytes) -> bool:
+        return await self._run(_checkpw, password, hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        # hashes look like b"$2b$12$<salt+checksum>"
+        return int(hashed_password.split(b"$")[2]) != self.rounds
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": self.in_flight, "queue_depth": self.queue_depth}
+
+
+password_hasher = PasswordHasher(
+    rounds=settings.PASSWORD_HASH_ROUNDS,
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    pool=settings.PASSWORD_HASH_POOL,
+)
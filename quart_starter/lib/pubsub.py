@@ -1,17 +1,40 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+import asyncpg
 import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from tortoise import connections
+from tortoise.exceptions import OperationalError
+
+from quart_starter import settings
+
+from .notify import notify
+
+logger = logging.getLogger(__name__)
+
+# what a backend raises when the broker can't be reached
+PUBSUB_ERRORS = (RedisError, OSError, asyncpg.PostgresError, OperationalError)
 
 
 class PubSubManager:
+    # whether messages reach other processes
+    distributed = True
+    # whether nodes can keep their channel membership in the same Redis
+    tracks_presence = False
+
     async def connect(self) -> None:
         raise NotImplementedError()
 
     async def publish(self, channel_id: str, message: str) -> None:
         raise NotImplementedError()
 
-    async def subscribe(self, channel_id: str) -> aioredis.Redis:
+    async def subscribe(self, *channel_ids: str) -> aioredis.Redis:
         raise NotImplementedError()
 
-    async def unsubscribe(self, channel_id: str) -> None:
+    async def unsubscribe(self, *channel_ids: str) -> None:
         raise NotImplementedError()
 
 
@@ -24,6 +47,8 @@ class RedisPubSubManager(PubSubManager):
         port (int): Redis server port.
     """
 
+    tracks_presence = True
+
     def __init__(self, host="localhost", port=6379):
         self.redis_host = host
         self.redis_port = port
@@ -59,24 +84,202 @@ class RedisPubSubManager(PubSubManager):
         """
         await self.redis_connection.publish(channel_id, message)
 
-    async def subscribe(self, channel_id: str) -> aioredis.Redis:
+    async def subscribe(self, *channel_ids: str) -> aioredis.Redis:
         """
-        Subscribes to a Redis channel.
+        Subscribes to one or more Redis channels with a single command.
 
         Args:
-            channel_id (str): Channel ID to subscribe to.
+            channel_ids (str): Channel IDs to subscribe to.
 
         Returns:
-            aioredis.ChannelSubscribe: PubSub object for the subscribed channel.
+            aioredis.ChannelSubscribe: PubSub object for the subscribed channels.
         """
-        await self.pubsub.subscribe(channel_id)
+        await self.pubsub.subscribe(*channel_ids)
         return self.pubsub
 
-    async def unsubscribe(self, channel_id: str) -> None:
+    async def unsubscribe(self, *channel_ids: str) -> None:
         """
-        Unsubscribes from a Redis channel.
+        Unsubscribes from one or more Redis channels with a single command.
 
         Args:
-            channel_id (str): Channel ID to unsubscribe from.
+            channel_ids (str): Channel IDs to unsubscribe from.
         """
-        await self.pubsub.unsubscribe(channel_id)
+        await self.pubsub.unsubscribe(*channel_ids)
+
+
+class _QueueSubscriber:
+    def __init__(self):
+        """
+        Hands out messages queued by the in-process and Postgres backends in the shape
+        Redis returns them, as str rather than bytes.
+        """
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, channel_id: str, message, kind: str = "message") -> None:
+        self.queue.put_nowait({"type": kind, "channel": channel_id, "data": message})
+
+    def put_exception(self, error: Exception) -> None:
+        self.queue.put_nowait(error)
+
+    async def get_message(
+        self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = 0
+    ) -> Optional[dict]:
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        if isinstance(message, Exception):
+            raise message
+
+        # like Redis, subscription confirmations read as "no message" when ignored
+        if ignore_subscribe_messages and message["type"] != "message":
+            return None
+        return message
+
+
+class InProcessPubSubManager(PubSubManager):
+    """
+    Delivers messages between managers in the same process without serializing
+    them, for single node deployments and tests.
+    """
+
+    distributed = False
+
+    # channel => subscribers across every manager in the process
+    _channels: Dict[str, Set[_QueueSubscriber]] = defaultdict(set)
+
+    def __init__(self):
+        self.channel_ids: Set[str] = set()
+        self.subscriber = _QueueSubscriber()
+
+    async def connect(self) -> None:
+        pass
+
+    async def publish(self, channel_id: str, message: str) -> None:
+        for subscriber in self._channels.get(channel_id, ()):
+            subscriber.put(channel_id, message)
+
+    async def subscribe(self, *channel_ids: str) -> _QueueSubscriber:
+        for channel_id in channel_ids:
+            self._channels[channel_id].add(self.subscriber)
+            self.channel_ids.add(channel_id)
+            self.subscriber.put(channel_id, len(self.channel_ids), "subscribe")
+        return self.subscriber
+
+    async def unsubscribe(self, *channel_ids: str) -> None:
+        for channel_id in channel_ids:
+            self.channel_ids.discard(channel_id)
+            subscribers = self._channels.get(channel_id)
+            if subscribers is not None:
+                subscribers.discard(self.subscriber)
+                if not subscribers:
+                    del self._channels[channel_id]
+
+
+class PostgresPubSubManager(PubSubManager):
+    """
+    Publishes with NOTIFY over the Tortoise connection pool and LISTENs on a
+    dedicated connection using the same credentials.  Postgres limits payloads to
+    8000 bytes and channel names to 63 characters.
+
+    Args:
+        connection_name (str): Tortoise connection to use.
+    """
+
+    def __init__(self, connection_name: str = "default"):
+        self.connection_name = connection_name
+        self.channel_ids: Set[str] = set()
+        self.subscriber = _QueueSubscriber()
+        self._connection: Optional[asyncpg.Connection] = None
+        # subscribers and the reconnect loop must not both open a connection
+        self._lock = asyncio.Lock()
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+    def _on_notification(self, _connection, _pid, channel_id: str, payload: str):
+        self.subscriber.put(channel_id, payload)
+
+    def _on_termination(self, _connection) -> None:
+        self._connection = None
+        self.subscriber.put_exception(ConnectionError("listener connection lost"))
+        # the loop only keeps a weak reference to the task
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.get_running_loop().create_task(
+                self._reconnect()
+            )
+
+    async def _reconnect(self) -> None:
+        while self._connection is None:
+            try:
+                await self.connect()
+            except PUBSUB_ERRORS as error:
+                logger.warning("unable to reconnect listener: %s", error)
+                await asyncio.sleep(1)
+
+    async def connect(self) -> None:
+        """
+        Opens the listening connection, LISTENing again on every subscribed channel
+        after it was lost.
+        """
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed():
+                return
+
+            client = connections.get(self.connection_name)
+            connection = await asyncpg.connect(
+                host=client.host,
+                port=client.port,
+                user=client.user,
+                password=client.password,
+                database=client.database,
+            )
+            try:
+                for channel_id in self.channel_ids:
+                    await connection.add_listener(channel_id, self._on_notification)
+            except BaseException:
+                connection.terminate()
+                raise
+
+            connection.add_termination_listener(self._on_termination)
+            self._connection = connection
+
+    async def publish(self, channel_id: str, message: str) -> None:
+        """
+        Raises:
+            OperationalError: When the NOTIFY fails, e.g. for a payload that is too
+                large, part of PUBSUB_ERRORS like the other backends' errors.
+        """
+        await notify(channel_id, message, self.connection_name)
+
+    async def subscribe(self, *channel_ids: str) -> _QueueSubscriber:
+        await self.connect()
+        for channel_id in channel_ids:
+            await self._connection.add_listener(channel_id, self._on_notification)
+            self.channel_ids.add(channel_id)
+            self.subscriber.put(channel_id, len(self.channel_ids), "subscribe")
+        return self.subscriber
+
+    async def unsubscribe(self, *channel_ids: str) -> None:
+        for channel_id in channel_ids:
+            self.channel_ids.discard(channel_id)
+            if self._connection is not None:
+                await self._connection.remove_listener(
+                    channel_id, self._on_notification
+                )
+
+
+def get_pubsub_manager(backend: Optional[str] = None) -> PubSubManager:
+    """
+    Creates a PubSubManager for `backend`, one of "redis", "postgres" or "memory",
+    defaulting to settings.PUBSUB_BACKEND.
+    """
+    backend = backend or settings.PUBSUB_BACKEND
+
+    if backend == "memory":
+        return InProcessPubSubManager()
+    if backend == "postgres":
+        return PostgresPubSubManager()
+    if backend == "redis":
+        return RedisPubSubManager(settings.REDIS_HOST, settings.REDIS_PORT)
+
+    raise ValueError(f"unknown pubsub backend {backend!r}")
@@ -0,0 +1,28 @@
+import json
+from typing import List, Optional
+
+
+async def explain(connection, sql: str, values: Optional[list] = None) -> dict:
+    """
+    Returns the planner's plan for `sql` without running it.
+    """
+    rows = await connection.execute_query_dict(f"EXPLAIN (FORMAT JSON) {sql}", values)
+    plan = rows[0]["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]["Plan"]
+
+
+def seq_scans(plan: dict) -> List[str]:
+    """
+    Returns the relations read with a sequential scan anywhere in `plan`.
+    """
+    relations = []
+    if plan["Node Type"] == "Seq Scan":
+        relations.append(plan["Relation Name"])
+
+    for child in plan.get("Plans", []):
+        relations.extend(seq_scans(child))
+
+    return relations
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+
+from redis.exceptions import RedisError
+
+from .cache import TTLCache
+from .error import RateLimitedActionError
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return allowed
+"""
+
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, capacity: int, refill_per_minute: float):
+        """
+        A token bucket per key, shared through Redis with an in-process fallback.
+
+        Args:
+            name (str): Prefix for the Redis keys.
+            capacity (int): Maximum burst size.
+            refill_per_minute (float): Tokens added back to a bucket per minute.
+        """
+        self.name = name
+        self.capacity = capacity
+        self.rate = refill_per_minute / 60
+        self._script = None
+        self._local = TTLCache(maxsize=100000, ttl=capacity / self.rate + 1)
+
+    def _acquire_local(self, key: str) -> bool:
+        now = time.monotonic()
+        tokens, ts = self._local.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - ts) * self.rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self._local.set(key, (tokens, now))
+        return allowed
+
+    async def acquire(self, key: str) -> bool:
+        """
+        Takes a token from the bucket for `key`.
+
+        Returns:
+            bool: False when the bucket is empty.
+        """
+        try:
+            if self._script is None:
+                self._script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+            return bool(
+                await self._script(
+                    keys=[f"ratelimit:{self.name}:{key}"],
+                    args=[self.capacity, self.rate],
+                )
+            )
+        except RedisError as error:
+            logger.warning("rate limiter falling back to local state: %s", error)
+            return self._acquire_local(key)
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int):
+        """
+        Caps the number of concurrent holders, rejecting rather than queueing the rest.
+
+        Example usage:
+            ```py
+            with limiter:
+                await expensive_work()  # raises RateLimitedActionError when full
+            ```
+        """
+        self.limit = limit
+        self.active = 0
+
+    def __enter__(self):
+        if self.active >= self.limit:
+            raise RateLimitedActionError()
+        self.active += 1
+        return self
+
+    def __exit__(self, *_):
+        self.active -= 1
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        target_latency: float = 1,
+        backoff: float = 0.5,
+    ):
+        """
+        Caps the number of concurrent holders with a limit that adapts (AIMD), waiting
+        for a free slot rather than rejecting.
+
+        The limit grows by one for every `limit` fast successes and is multiplied by
+        `backoff` on an error or a response slower than `target_latency`, at most
+        once per `target_latency` so a burst of failures counts once.
+
+        Example usage:
+            ```py
+            async with limiter:
+                start = time.monotonic()
+                ok = await call()
+            limiter.record(time.monotonic() - start, ok)
+            ```
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *_):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, latency: float, success: bool) -> None:
+        now = time.monotonic()
+        if success and latency <= self.target_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif now - self._last_decrease >= self.target_latency:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._last_decrease = now
@@ -0,0 +1,26 @@
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+from quart_starter import settings
+
+_connection: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """
+    Returns the process wide Redis client used for caching and counters.
+
+    Timeouts are kept short so callers can fall back to in-process state when Redis
+    is unavailable instead of stalling the request.
+    """
+    global _connection  # pylint: disable=global-statement
+
+    if _connection is None:
+        _connection = aioredis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            socket_connect_timeout=settings.REDIS_TIMEOUT,
+            socket_timeout=settings.REDIS_TIMEOUT,
+        )
+    return _connection
@@ -0,0 +1,139 @@
+import time
+from typing import Dict, NamedTuple, Optional
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from quart_starter import schemas, settings
+
+from .bloom import BloomFilter
+
+PREFIX = "st."
+
+# tokens issued before this process started may have been revoked while it was down,
+# moved forward whenever revocations may have been missed
+trusted_since = time.time()
+
+
+def _revocation_filter() -> BloomFilter:
+    return BloomFilter(
+        capacity=settings.REVOCATION_FILTER_CAPACITY,
+        error_rate=settings.REVOCATION_FILTER_ERROR_RATE,
+    )
+
+
+# revoked auth ids, rotated every SESSION_TOKEN_MAX_AGE so the filters don't fill
+# up, an auth id is kept at least that long, after which its tokens have expired
+revoked = _revocation_filter()
+previously_revoked = _revocation_filter()
+rotated_at = time.time()
+
+# user id => when every token of the user was revoked, tokens issued afterwards
+# are trusted again
+users_revoked_at: Dict[int, float] = {}
+
+serializer = URLSafeTimedSerializer(settings.SECRET_KEY, salt="session-token")
+
+
+class SessionToken(NamedTuple):
+    auth_id: str
+    token: schemas.Token
+    user: schemas.User
+    trusted: bool
+
+
+def dump(token: schemas.TokenCreateSuccess, user: schemas.User) -> str:
+    """
+    Creates a signed token carrying everything needed to authenticate a request.
+
+    Args:
+        token (TokenCreateSuccess): The token row backing this session.
+        user (User): The user the token belongs to.
+
+    Returns:
+        str: Value to hand to `login_user` or return to the client as a bearer token.
+    """
+    return PREFIX + serializer.dumps(
+        {
+            "aid": token.auth_id,
+            "t": [token.id, token.type, token.name],
+            "u": user.model_dump(mode="json"),
+        }
+    )
+
+
+def load(value: Optional[str]) -> Optional[SessionToken]:
+    """
+    Verifies a token created by `dump`.
+
+    Returns None for opaque auth ids or bad signatures.  Expired, possibly revoked or
+    stale tokens are returned untrusted so the caller can check the embedded auth id
+    against the database.
+    """
+    if not value or not value.startswith(PREFIX):
+        return None
+
+    try:
+        payload, issued_at = serializer.loads(
+            value[len(PREFIX) :],
+            max_age=settings.SESSION_TOKEN_MAX_AGE,
+            return_timestamp=True,
+        )
+        issued_at = issued_at.timestamp()
+        trusted = issued_at >= trusted_since
+    except SignatureExpired as error:
+        payload = serializer.load_payload(error.payload)
+        issued_at = None
+        trusted = False
+    except BadSignature:
+        return None
+
+    user = schemas.User.model_validate(payload["u"])
+    token_id, token_type, token_name = payload["t"]
+    token = schemas.Token(
+        id=token_id, type=token_type, name=token_name, user_id=user.id, user=None
+    )
+
+    if trusted:
+        _rotate()
+        trusted = not (
+            payload["aid"] in revoked
+            or payload["aid"] in previously_revoked
+            or issued_at <= users_revoked_at.get(user.id, 0)
+        )
+
+    return SessionToken(payload["aid"], token, user, trusted)
+
+
+def revoke(auth_id: str = None, user_id: int = None) -> None:
+    _rotate()
+
+    if auth_id:
+        revoked.add(auth_id)
+
+    if user_id is not None:
+        users_revoked_at[user_id] = time.time()
+
+
+def _rotate() -> None:
+    global revoked, previously_revoked, rotated_at  # pylint: disable=global-statement
+
+    now = time.time()
+    if now - rotated_at < settings.SESSION_TOKEN_MAX_AGE:
+        return
+
+    previously_revoked, revoked = revoked, _revocation_filter()
+    rotated_at = now
+
+    for user_id, revoked_at in list(users_revoked_at.items()):
+        if now - revoked_at > settings.SESSION_TOKEN_MAX_AGE:
+            del users_revoked_at[user_id]
+
+
+def distrust_issued_before(timestamp: float) -> None:
+    """
+    Stops trusting tokens issued before `timestamp`, e.g. after revocations could
+    not be received, so they get checked against the database again.
+    """
+    global trusted_since  # pylint: disable=global-statement
+
+    trusted_since = max(trusted_since, timestamp)
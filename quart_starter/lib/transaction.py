@@ -0,0 +1,35 @@
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Optional
+
+from tortoise import transactions
+
+from .cache import invalidator
+
+
+@asynccontextmanager
+async def in_transaction(connection_name: Optional[str] = None):
+    """
+    Same as `tortoise.transactions.in_transaction`, but cache invalidations made
+    inside the block are only published once the transaction has committed.
+    """
+    async with invalidator.deferred():
+        async with transactions.in_transaction(connection_name) as connection:
+            yield connection
+
+
+def atomic(connection_name: Optional[str] = None):
+    """
+    Same as `tortoise.transactions.atomic`, but cache invalidations made inside the
+    function are only published once the transaction has committed.
+    """
+
+    def wrapper(func):
+        @wraps(func)
+        async def wrapped(*args, **kwargs):
+            async with in_transaction(connection_name):
+                return await func(*args, **kwargs)
+
+        return wrapped
+
+    return wrapper
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import httpx
+
+from .rate_limit import AdaptiveConcurrencyLimiter
+
+
+class WebhookResponse(NamedTuple):
+    status_code: int
+    text: str
+
+
+class WebhookDispatcher:
+    def __init__(
+        self,
+        url: str,
+        concurrency: int = 10,
+        timeout: float = 5,
+        max_response_length: int = 256,
+        max_batch_response_length: int = 1024 * 1024,
+        batch_size: int = 1,
+        batch_wait: float = 0.05,
+        target_latency: float = 1,
+    ):
+        """
+        Delivers webhooks over a pool of keep-alive connections, with at most
+        `concurrency` requests in flight at once.  The limit backs off while the
+        receiver errors or answers slower than `target_latency` and recovers as it
+        speeds up again.
+
+        With a `batch_size` above 1, payloads passed to `post_batched` are grouped
+        into a single JSON array POST of up to `batch_size` items, waiting at most
+        `batch_wait` seconds for a batch to fill up.  The receiver answers with a
+        JSON object mapping each id to "OK" or an error.
+
+        Args:
+            url (str): Endpoint the webhooks are posted to.
+            concurrency (int): Maximum number of requests in flight.
+            timeout (float): Seconds to wait for connecting, sending and each read.
+            max_response_length (int): Number of characters of the response body kept
+                per webhook, the rest is never read.
+            max_batch_response_length (int): Number of characters of a batch
+                response read, enough for the whole JSON answer so it can be split
+                up before each webhook's part is cut to `max_response_length`.
+            batch_size (int): Maximum number of webhooks per request.
+            batch_wait (float): Seconds a partial batch waits before it is sent.
+            target_latency (float): Seconds a healthy receiver takes to answer.
+        """
+        self.url = url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_response_length = max_response_length
+        self.max_batch_response_length = max_batch_response_length
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.target_latency = target_latency
+        self._client: Optional[httpx.AsyncClient] = None
+        self._limiter: Optional[AdaptiveConcurrencyLimiter] = None
+        self._batch: List[Tuple[int, Any, asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def batching(self) -> bool:
+        return self.batch_size > 1
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency,
+                ),
+            )
+        return self._client
+
+    @property
+    def limiter(self) -> AdaptiveConcurrencyLimiter:
+        if self._limiter is None:
+            self._limiter = AdaptiveConcurrencyLimiter(
+                self.concurrency, target_latency=self.target_latency
+            )
+        return self._limiter
+
+    async def _request(self, payload, max_length: int) -> WebhookResponse:
+        async with self.limiter:
+            started_at = time.monotonic()
+            success = False
+            try:
+                async with self.client.stream(
+                    "POST", self.url, json=payload
+                ) as response:
+                    text = await self._read_text(response, max_length)
+                success = response.status_code < 500
+                return WebhookResponse(response.status_code, text)
+            finally:
+                self.limiter.record(time.monotonic() - started_at, success)
+
+    async def _read_text(self, response: httpx.Response, max_length: int) -> str:
+        text = ""
+        async for chunk in response.aiter_text():
+            text += chunk
+            if len(text) >= max_length:
+                break
+        return text[:max_length]
+
+    async def post(self, payload) -> WebhookResponse:
+        """
+        Posts `payload` as JSON.
+
+        Raises:
+            httpx.HTTPError: When the request could not be completed.
+        """
+        return await self._request(payload, self.max_response_length)
+
+    async def post_batched(self, id: int, payload: Dict[str, Any]) -> WebhookResponse:
+        """
+        Posts `payload`, identified by `id`, as part of the next batch.
+
+        Returns:
+            WebhookResponse: The outcome for this payload alone, the text is "OK" on
+                success and the receiver's error otherwise.
+
+        Raises:
+            httpx.HTTPError: When the batch request could not be completed.
+        """
+        if not self.batching:
+            return await self.post(payload)
+
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((id, payload, future))
+
+        if len(self._batch) >= self.batch_size:
+            self._send_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(
+                self.batch_wait, self._send_batch
+            )
+
+        return await future
+
+    def _send_batch(self) -> None:
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.ensure_future(self._post_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _post_batch(self, batch: List[Tuple[int, Any, asyncio.Future]]) -> None:
+        try:
+            status_code, text = await self._request(
+                [{"id": id, **payload} for id, payload, _ in batch],
+                self.max_batch_response_length,
+            )
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        try:
+            results = json.loads(text)
+        except ValueError:
+            results = None
+
+        for id, _, future in batch:
+            if isinstance(results, dict):
+                result = results.get(str(id), "missing from response")
+            else:
+                # not a per event answer, every event gets the whole body
+                result = text
+
+            if future.done():
+                continue
+            future.set_result(
+                WebhookResponse(status_code, str(result)[: self.max_response_length])
+            )
+
+    async def close(self) -> None:
+        self._send_batch()
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks)
+
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
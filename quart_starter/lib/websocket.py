@@ -1,23 +1,240 @@
 import asyncio
+import logging
+import time
+import zlib
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
 
 from quart import Websocket
+from redis.exceptions import RedisError
 
-from .pubsub import PubSubManager
+from .cache import TTLCache
+from .pubsub import PUBSUB_ERRORS, PubSubManager
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+
+def _text(value) -> str:
+    # Redis hands out bytes, the other backends str
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class SocketWriter:
+    def __init__(
+        self,
+        socket: Websocket,
+        maxsize: int,
+        policy: str,
+        on_error: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Sends queued messages to a single Websocket from its own task, so a slow
+        client only ever holds up itself.
+
+        Args:
+            socket (Websocket): Websocket connection object.
+            maxsize (int): Number of messages queued before `policy` kicks in.
+            policy (str): DROP_OLDEST to make room by dropping the oldest message,
+                DISCONNECT to give up on the client.
+            on_error (Callable): Called once sending failed and the writer stopped.
+        """
+        self.socket = socket
+        self.policy = policy
+        self.on_error = on_error
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.task = asyncio.create_task(self._run())
+
+    def put(self, data: str) -> bool:
+        """
+        Queues `data` without waiting.
+
+        Returns:
+            bool: False when the client can't keep up and should be disconnected.
+        """
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            if self.policy == DISCONNECT:
+                return False
+
+            self.queue.get_nowait()
+            self.queue.put_nowait(data)
+            self.dropped += 1
+
+        return True
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                await self.socket.send(await self.queue.get())
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.info("websocket writer stopped: %s", e)
+
+            if self.on_error is not None:
+                self.on_error()
+
+    def close(self) -> None:
+        self.task.cancel()
+
+
+class ChannelShard:
+    def __init__(
+        self,
+        pubsub_client: PubSubManager,
+        reader: Callable[[object], Awaitable[None]],
+        batch_delay: float = 0.01,
+    ):
+        """
+        One pubsub connection carrying its share of the channels.  Subscribes and
+        unsubscribes requested within `batch_delay` seconds go out as one command
+        each, and a channel left and rejoined in between causes no traffic at all.
+
+        Args:
+            pubsub_client (PubSubManager): Connection for this shard.
+            reader (Callable): Coroutine reading the subscriber until cancelled.
+            batch_delay (float): Seconds changes are collected before being sent.
+        """
+        self.pubsub_client = pubsub_client
+        self.reader = reader
+        self.batch_delay = batch_delay
+        self.subscribed: Set[str] = set()
+        # channel => whether it should end up subscribed
+        self.pending: Dict[str, bool] = {}
+        self.reader_task: Optional[asyncio.Task] = None
+        self._flushed: Optional[asyncio.Future] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, channel_id: str) -> None:
+        """
+        Subscribes to `channel_id`, returning once the batch it is part of was sent.
+        """
+        self.pending[channel_id] = True
+        await asyncio.shield(self._schedule())
+
+    def unsubscribe(self, channel_id: str) -> None:
+        self.pending[channel_id] = False
+        self._schedule()
+
+    def _schedule(self) -> asyncio.Future:
+        if self._flushed is None:
+            self._flushed = asyncio.get_running_loop().create_future()
+            asyncio.get_running_loop().call_later(self.batch_delay, self._start_flush)
+        return self._flushed
+
+    def _start_flush(self) -> None:
+        task = asyncio.create_task(self._flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            # taken only now, so the diff sees what the previous batch did
+            pending, self.pending = self.pending, {}
+            flushed, self._flushed = self._flushed, None
+
+            subscribe = [
+                c for c, s in pending.items() if s and c not in self.subscribed
+            ]
+            unsubscribe = [
+                c for c, s in pending.items() if not s and c in self.subscribed
+            ]
+
+            try:
+                await self.pubsub_client.connect()
+                if subscribe:
+                    pubsub_subscriber = await self.pubsub_client.subscribe(*subscribe)
+                    self.subscribed.update(subscribe)
+
+                    if self.reader_task is None:
+                        self.reader_task = asyncio.create_task(
+                            self.reader(pubsub_subscriber)
+                        )
+                if unsubscribe:
+                    await self.pubsub_client.unsubscribe(*unsubscribe)
+                    self.subscribed.difference_update(unsubscribe)
+            except PUBSUB_ERRORS as error:
+                logger.warning("unable to update subscriptions: %s", error)
+
+                # retry with the next batch, unless the channels changed in between
+                for channel_id, state in pending.items():
+                    self.pending.setdefault(channel_id, state)
+                flushed.set_exception(error)
+                flushed.exception()  # unsubscribes have nobody waiting
+                asyncio.get_running_loop().call_later(1, self._schedule)
+            else:
+                flushed.set_result(None)
 
 
 class WebsocketManager:
-    def __init__(self, pubsub_client: PubSubManager):
+    def __init__(
+        self,
+        pubsub_clients: List[PubSubManager],
+        send_queue_size: int = 100,
+        slow_consumer_policy: str = DROP_OLDEST,
+        subscribe_batch_delay: float = 0.01,
+        presence_ttl: float = 30,
+        presence_cache_ttl: float = 1,
+        coalesce_window: float = 0.25,
+    ):
         """
         Initializes the WebsocketManager.
 
+        Broadcasts are delivered to this process' Websockets right away and only
+        published when another node has Websockets in the channel.  With the Redis
+        backend every node keeps its membership in an expiring Redis set per
+        channel, other distributed backends always publish.  Nodes tag what they
+        publish with their node id so they skip their own messages when they come
+        back through the subscription.
+
         Attributes:
-            channels (dict): A dictionary to store Websocket connections in different channels.
-            pubsub_client (RedisPubSubManager): An instance of the PubSubManager class
-                for pub-sub functionality.
+            channels (dict): A dictionary to store the writers of the Websocket
+                connections in different channels.
+            pubsub_clients (list[PubSubManager]): Instances of the PubSubManager
+                class for pub-sub functionality, channels are spread across them by
+                hash.
+            send_queue_size (int): Messages queued per Websocket.
+            slow_consumer_policy (str): What to do once a Websocket's queue is full,
+                DROP_OLDEST or DISCONNECT.
+            subscribe_batch_delay (float): Seconds subscription changes are collected
+                before being sent.
+            presence_ttl (float): Seconds a node stays listed in a channel without
+                refreshing its membership.
+            presence_cache_ttl (float): Seconds the other nodes in a channel are
+                remembered, a node joining a channel may miss broadcasts for as long.
+            coalesce_window (float): Seconds `broadcast_latest` waits for newer
+                messages of the same kind before broadcasting.
         """
-        self.channels: dict = {}
-        self.pubsub_client = pubsub_client
-        self.task_initialized = False
+        self.channels: Dict[str, Dict[Websocket, SocketWriter]] = {}
+        self.shards = [
+            ChannelShard(client, self._pubsub_data_reader, subscribe_batch_delay)
+            for client in pubsub_clients
+        ]
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.disconnected: Dict[str, int] = defaultdict(int)
+        self.node_id = uuid4().hex
+        self.presence_ttl = presence_ttl
+        self.remote_nodes = TTLCache(maxsize=10000, ttl=presence_cache_ttl)
+        # a single process backend has no other nodes to track
+        self.distributed = any(client.distributed for client in pubsub_clients)
+        # presence lives in Redis, which other backends shouldn't depend on
+        self.tracks_presence = self.distributed and all(
+            client.tracks_presence for client in pubsub_clients
+        )
+        self.coalesce_window = coalesce_window
+        # (channel, kind) => latest message waiting for the window to end
+        self.latest: Dict[Tuple[str, str], str] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def shard(self, channel_id: str) -> ChannelShard:
+        return self.shards[zlib.crc32(channel_id.encode("utf-8")) % len(self.shards)]
 
     async def add_user_to_channel(self, channel_id: str, socket: Websocket) -> None:
         """
@@ -29,16 +246,29 @@ class WebsocketManager:
         """
         await socket.accept()
 
+        writer = SocketWriter(
+            socket,
+            self.send_queue_size,
+            self.slow_consumer_policy,
+            # the socket is gone, stop queueing messages for it
+            on_error=lambda: self._spawn(
+                self.remove_user_from_channel(channel_id, socket)
+            ),
+        )
+
         if channel_id in self.channels:
-            self.channels[channel_id].append(socket)
-        else:
-            self.channels[channel_id] = [socket]
+            self.channels[channel_id][socket] = writer
+            return
 
-            await self.pubsub_client.connect()
-            pubsub_subscriber = await self.pubsub_client.subscribe(channel_id)
-            if not self.task_initialized:
-                self.task_initialized = True
-                asyncio.create_task(self._pubsub_data_reader(pubsub_subscriber))
+        self.channels[channel_id] = {socket: writer}
+        try:
+            await self.shard(channel_id).subscribe(channel_id)
+        except PUBSUB_ERRORS:
+            # the socket would never see a message from another node
+            await self.remove_user_from_channel(channel_id, socket)
+            raise
+
+        await self._join(channel_id)
 
     async def broadcast_to_channel(self, channel_id: str, message: str) -> None:
         """
@@ -48,8 +278,44 @@ class WebsocketManager:
             channel_id (str): Channel ID.
             message (str): Message to be broadcasted.
         """
-        await self.pubsub_client.connect()
-        await self.pubsub_client.publish(channel_id, message)
+        self.fanout(channel_id, message)
+
+        if not await self._has_remote_nodes(channel_id):
+            return
+
+        pubsub_client = self.shard(channel_id).pubsub_client
+        try:
+            await pubsub_client.connect()
+            await pubsub_client.publish(channel_id, f"{self.node_id} {message}")
+        except PUBSUB_ERRORS as error:
+            # local sockets already have it, only the other nodes miss out
+            logger.warning("unable to publish to %s: %s", channel_id, error)
+
+    def broadcast_latest(self, channel_id: str, kind: str, message: str) -> None:
+        """
+        Broadcasts a message in the background, messages of the same `kind` queued
+        for a channel within the coalesce window replace each other so only the
+        latest one goes out.
+
+        Args:
+            channel_id (str): Channel ID.
+            kind (str): What the message describes, e.g. the message type.
+            message (str): Message to be broadcasted.
+        """
+        key = (channel_id, kind)
+        if key not in self.latest:
+            asyncio.get_running_loop().call_later(
+                self.coalesce_window, self._broadcast_latest, key
+            )
+        self.latest[key] = message
+
+    def _broadcast_latest(self, key: Tuple[str, str]) -> None:
+        self._spawn(self.broadcast_to_channel(key[0], self.latest.pop(key)))
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
     async def remove_user_from_channel(
         self, channel_id: str, socket: Websocket
@@ -61,11 +327,123 @@ class WebsocketManager:
             channel_id (str): Channel ID.
             websocket (Websocket): Websocket connection object.
         """
-        self.channels[channel_id].remove(socket)
+        writer = self.channels.get(channel_id, {}).pop(socket, None)
+        if writer is None:
+            return  # already disconnected as a slow consumer
+
+        writer.close()
 
         if len(self.channels[channel_id]) == 0:
             del self.channels[channel_id]
-            await self.pubsub_client.unsubscribe(channel_id)
+            self.disconnected.pop(channel_id, None)
+            self.shard(channel_id).unsubscribe(channel_id)
+            await self._leave(channel_id)
+
+    @staticmethod
+    def _presence_key(channel_id: str) -> str:
+        return f"websocket-nodes:{channel_id}"
+
+    async def _join(self, channel_id: str) -> None:
+        if not self.tracks_presence:
+            return
+
+        try:
+            await self._refresh_presence([channel_id])
+        except RedisError as error:
+            logger.warning("unable to join %s: %s", channel_id, error)
+
+    async def _leave(self, channel_id: str) -> None:
+        if not self.tracks_presence:
+            return
+
+        try:
+            await get_redis().zrem(self._presence_key(channel_id), self.node_id)
+        except RedisError as error:
+            logger.warning("unable to leave %s: %s", channel_id, error)
+
+    async def _refresh_presence(self, channel_ids: List[str]) -> None:
+        expires_at = time.time() + self.presence_ttl
+
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for channel_id in channel_ids:
+                key = self._presence_key(channel_id)
+                pipe.zadd(key, {self.node_id: expires_at})
+                pipe.zremrangebyscore(key, "-inf", time.time())
+                pipe.expire(key, int(self.presence_ttl) + 1)
+            await pipe.execute()
+
+    async def _has_remote_nodes(self, channel_id: str) -> bool:
+        if not self.tracks_presence:
+            return self.distributed
+
+        remote = self.remote_nodes.get(channel_id)
+        if remote is not None:
+            return remote
+
+        try:
+            nodes = await get_redis().zrangebyscore(
+                self._presence_key(channel_id), time.time(), "+inf"
+            )
+        except RedisError as error:
+            # publishing anyway is safe, we skip our own messages, and caching
+            # that keeps an unavailable Redis from being hit on every broadcast
+            logger.warning("unable to look up nodes in %s: %s", channel_id, error)
+            remote = True
+        else:
+            remote = any(node.decode("utf-8") != self.node_id for node in nodes)
+
+        self.remote_nodes.set(channel_id, remote)
+        return remote
+
+    async def run(self) -> None:
+        """
+        Keeps this node listed in its channels until cancelled.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.presence_ttl / 3)
+
+                if self.tracks_presence and self.channels:
+                    try:
+                        await self._refresh_presence(list(self.channels))
+                    except RedisError as error:
+                        logger.warning("unable to refresh presence: %s", error)
+        finally:
+            for channel_id in list(self.channels):
+                await self._leave(channel_id)
+
+    def fanout(self, channel_id: str, data: str) -> None:
+        """
+        Queues a decoded message for every Websocket in a channel.
+        """
+        for socket, writer in list(self.channels.get(channel_id, {}).items()):
+            if not writer.put(data):
+                self.disconnected[channel_id] += 1
+                self._spawn(self._disconnect(channel_id, socket))
+
+    async def _disconnect(self, channel_id: str, socket: Websocket) -> None:
+        await self.remove_user_from_channel(channel_id, socket)
+        try:
+            await socket.close(1008, "too slow")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.info("unable to close slow websocket: %s", e)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Per channel number of Websockets, messages waiting to be sent and messages
+        dropped or clients disconnected for being too slow.
+        """
+        stats = {}
+        for channel_id, writers in self.channels.items():
+            depths = [writer.queue.qsize() for writer in writers.values()]
+            stats[channel_id] = {
+                "sockets": len(writers),
+                "queued": sum(depths),
+                "max_queued": max(depths, default=0),
+                "dropped": sum(writer.dropped for writer in writers.values()),
+                "disconnected": self.disconnected.get(channel_id, 0),
+            }
+        return stats
 
     async def _pubsub_data_reader(self, pubsub_subscriber):
         """
@@ -75,13 +453,26 @@ class WebsocketManager:
             pubsub_subscriber (ChannelSubscribe): PubSub object for the subscribed channel.
         """
         while True:
-            message = await pubsub_subscriber.get_message(
-                ignore_subscribe_messages=True
-            )
+            try:
+                # blocks until a message arrives instead of polling
+                message = await pubsub_subscriber.get_message(
+                    ignore_subscribe_messages=True, timeout=None
+                )
+            except PUBSUB_ERRORS as error:
+                logger.warning("websocket pubsub reader failed: %s", error)
+                await asyncio.sleep(1)
+                continue
+
             if message is not None:
-                channel_id = message["channel"].decode("utf-8")
-                if channel_id in self.channels:
-                    all_sockets = self.channels[channel_id]
-                    for socket in all_sockets:
-                        data = message["data"].decode("utf-8")
-                        await socket.send(data)
+                node_id, separator, data = _text(message["data"]).partition(" ")
+                if not separator:
+                    logger.warning("skipping message without a node id")
+                    continue
+
+                if node_id == self.node_id:
+                    continue  # already delivered locally
+
+                self.fanout(_text(message["channel"]), data)
+
+                # let the writers drain before taking the next buffered message
+                await asyncio.sleep(0)
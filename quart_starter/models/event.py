@@ -14,8 +14,28 @@ class Event(TimestampMixin, Model):
     )
 
     worker_id = fields.CharField(max_length=36, null=True)
+    lease_expires_at = fields.DatetimeField(null=True)
     num_attempts = fields.IntField(default=0)
     attempted_at = fields.DatetimeField(null=True)
     next_attempt_at = fields.DatetimeField(auto_now_add=True)
     response_code = fields.IntField(null=True)
     response_text = fields.CharField(max_length=256, null=True)
+
+
+class EventArchive(Model):
+    id = fields.IntField(pk=True, generated=False)
+    name = fields.CharField(128)
+    data = fields.JSONField()
+    status = fields.CharEnumField(enums.EventStatus, max_length=16)
+
+    num_attempts = fields.IntField(default=0)
+    attempted_at = fields.DatetimeField(null=True)
+    response_code = fields.IntField(null=True)
+    response_text = fields.CharField(max_length=256, null=True)
+
+    created_at = fields.DatetimeField()
+    modified_at = fields.DatetimeField()
+    archived_at = fields.DatetimeField(auto_now_add=True, index=True)
+
+    class Meta:
+        table = "event_archive"
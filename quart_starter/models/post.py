@@ -20,6 +20,9 @@ class Post(TimestampMixin, Model):
     content = fields.TextField()
     published_at = fields.DatetimeField(null=True)
     viewed = fields.IntField(default=0)
+    unique_viewers = fields.IntField(default=0)
+    viewers_sketch = fields.BinaryField(null=True)
+    like_count = fields.IntField(default=0)
 
     author: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
         "models.User", related_name="documents"
@@ -1,10 +1,7 @@
-import base64
-import hashlib
-
-import bcrypt
 from tortoise import Model, fields
 
 from quart_starter import enums
+from quart_starter.lib.password import password_hasher
 
 
 class User(Model):
@@ -23,14 +20,10 @@ class User(Model):
     def __str__(self):
         return f"User {self.id}: {self.status}"
 
-    def set_password(self, password):
-        self.hashed_password = bcrypt.hashpw(
-            base64.b64encode(hashlib.sha256(password.encode("utf-8")).digest()),
-            bcrypt.gensalt(),
-        )
+    async def set_password(self, password):
+        self.hashed_password = await password_hasher.hash(password)
 
-    def check_password(self, password):
-        return self.hashed_password and bcrypt.checkpw(
-            base64.b64encode(hashlib.sha256(password.encode("utf-8")).digest()),
-            self.hashed_password,
+    async def check_password(self, password):
+        return bool(self.hashed_password) and await password_hasher.check(
+            password, self.hashed_password
         )
@@ -35,6 +35,7 @@ class Event(BaseModel):
     status: str
 
     worker_id: Optional[str]
+    lease_expires_at: Optional[datetime]
     num_attempts: int
     attempted_at: Optional[datetime]
     next_attempt_at: Optional[datetime]
@@ -96,11 +97,15 @@ class EventQueryString(BaseModel):
     status: Optional[enums.EventStatus] = None
     pp: Optional[int] = 10
     p: Optional[int] = 1
+    mode: Optional[enums.PaginationMode] = enums.PaginationMode.OFFSET
+    count: Optional[enums.CountStrategy] = enums.CountStrategy.EXACT
+    after: Optional[str] = None
+    before: Optional[str] = None
     resolves: Optional[List[EventResolve]] = []
 
     _parse_list = field_validator("id__in", "resolves", mode="before")(parse_list)
 
-    def to_query(self, resolves=None):
+    def to_query(self, resolves=None, mode=None, count=None):
         filters = []
         if self.id__in:
             filters.append(EventFilter(field=EventFilterField.ID_IN, value=self.id__in))
@@ -112,7 +117,17 @@ class EventQueryString(BaseModel):
 
         resolves = resolves or self.resolves
         sorts = self.sort.split("__")
-        page_info = PageInfo(num_per_page=self.pp, current_page=self.p)
+        if self.after or self.before:
+            mode = enums.PaginationMode.CURSOR
+
+        page_info = PageInfo(
+            num_per_page=self.pp,
+            current_page=self.p,
+            mode=mode or self.mode,
+            count_strategy=count or self.count,
+            after=self.after,
+            before=self.before,
+        )
         return EventQuery(
             filters=filters, sorts=sorts, resolves=resolves, page_info=page_info
         )
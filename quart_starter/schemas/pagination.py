@@ -1,30 +1,253 @@
+import base64
+import datetime as dt
+import hashlib
+import json
 import math
+from typing import List, Optional
+
+from tortoise import fields
+from tortoise.expressions import Q, RawSQL
+
+from quart_starter import enums, settings
+from quart_starter.lib.cache import TTLCache, invalidator
+from quart_starter.lib.error import ActionError
 
 from .helpers import BaseModel
 
+count_cache = TTLCache(maxsize=settings.COUNT_CACHE_SIZE, ttl=settings.COUNT_CACHE_TTL)
+
+
+def invalidate_count_cache(payload: dict) -> None:
+    count_cache.evict(lambda key, _: key[0] == payload["model"])
+
+
+invalidator.register("count", invalidate_count_cache)
+
+
+async def cached_count(queryset) -> int:
+    fingerprint = hashlib.sha1(queryset.sql().encode("utf-8")).hexdigest()
+    key = (queryset.model.__name__, fingerprint)
+
+    count = count_cache.get(key)
+    if count is None:
+        count = await queryset.count()
+        count_cache.set(key, count)
+
+    return count
+
+
+async def estimated_count(queryset) -> int:
+    """
+    Uses the planner's row estimate, which comes from pg_class.reltuples and the
+    column statistics, instead of scanning the table.
+    """
+    rows = await queryset.model._meta.db.execute_query_dict(
+        f"EXPLAIN (FORMAT JSON) {queryset.sql()}"
+    )
+    plan = rows[0]["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def encode_cursor(sorts: List[str], obj) -> str:
+    values = [getattr(obj, sort.lstrip("-")) for sort in sorts]
+    data = json.dumps({"s": sorts, "v": values}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(sorts: List[str], cursor: str, model) -> list:
+    # cursors come from the client, so anything that isn't exactly what
+    # encode_cursor produced is rejected rather than surfacing as a 500
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if not isinstance(data, dict) or not isinstance(data.get("v"), list):
+            raise ValueError("malformed cursor")
+    except ValueError as error:
+        raise ActionError("invalid cursor", loc="cursor", type="cursor") from error
+
+    if data.get("s") != sorts:
+        raise ActionError("cursor does not match sort", loc="cursor", type="cursor")
+
+    if len(data["v"]) != len(sorts):
+        raise ActionError("invalid cursor", loc="cursor", type="cursor")
+
+    values = []
+    try:
+        for sort, value in zip(sorts, data["v"]):
+            field = model._meta.fields_map[sort.lstrip("-")]
+            if value is not None:
+                value = field.to_python_value(
+                    dt.datetime.fromisoformat(value)
+                    if isinstance(field, fields.DatetimeField)
+                    else value
+                )
+            values.append(value)
+    except (TypeError, ValueError) as error:
+        raise ActionError("invalid cursor", loc="cursor", type="cursor") from error
+
+    return values
+
+
+def keyset_filter(sorts: List[str], values: list) -> Q:
+    """
+    Builds the filter matching every row that sorts after `values`.
+
+    Follows Postgres NULL ordering, NULLs sort last ascending and first descending.
+    """
+    clauses = []
+    equal = []
+    for sort, value in zip(sorts, values):
+        name = sort.lstrip("-")
+
+        if sort.startswith("-"):
+            after = (
+                Q(**{f"{name}__isnull": False})
+                if value is None
+                else Q(**{f"{name}__lt": value})
+            )
+        elif value is None:
+            after = None
+        else:
+            after = Q(**{f"{name}__gt": value}) | Q(**{f"{name}__isnull": True})
+
+        if after is not None:
+            clauses.append(Q(*equal, after))
+
+        equal.append(
+            Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+        )
+
+    if not clauses:
+        return Q(id__in=[])
+
+    return Q(*clauses, join_type=Q.OR)
+
+
+def reverse_sorts(sorts: List[str]) -> List[str]:
+    return [sort[1:] if sort.startswith("-") else f"-{sort}" for sort in sorts]
+
 
 class PageInfo(BaseModel):
     num_per_page: int = 10
     current_page: int = 1
+    mode: enums.PaginationMode = enums.PaginationMode.OFFSET
+    count_strategy: enums.CountStrategy = enums.CountStrategy.EXACT
+    after: Optional[str] = None
+    before: Optional[str] = None
 
-    async def paginate(self, queryset):
-        count = await queryset.count()
+    async def count(self, queryset):
+        if self.count_strategy in (
+            enums.CountStrategy.NONE,
+            enums.CountStrategy.WINDOW,
+        ):
+            # the window count is read off the page rows themselves
+            return None, self.count_strategy
 
-        queryset = queryset.limit(self.num_per_page).offset(
-            self.num_per_page * (self.current_page - 1)
-        )
+        if self.count_strategy == enums.CountStrategy.CACHED:
+            return await cached_count(queryset), enums.CountStrategy.CACHED
+
+        if self.count_strategy == enums.CountStrategy.ESTIMATED:
+            # narrow filters are cheap to count and estimates are poor for them
+            estimate = await estimated_count(queryset)
+            if estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+                return estimate, enums.CountStrategy.ESTIMATED
+
+        return await queryset.count(), enums.CountStrategy.EXACT
+
+    def _offset_page(self, queryset, sorts):
+        page = queryset.order_by(*sorts)
+        return page.offset(self.num_per_page * (self.current_page - 1))
+
+    def _cursor_page(self, queryset, sorts):
+        sorts = [str(x) for x in sorts]
+        if "id" not in sorts and "-id" not in sorts:
+            sorts.append("id")
+
+        backwards = self.before is not None and self.after is None
+        order = reverse_sorts(sorts) if backwards else sorts
+
+        cursor = self.before if backwards else self.after
+        if cursor:
+            values = decode_cursor(sorts, cursor, queryset.model)
+            queryset = queryset.filter(keyset_filter(order, values))
 
-        return queryset, Pagination(
+        # one extra row tells us whether there is another page
+        page = queryset.order_by(*order).limit(self.num_per_page + 1)
+        return page, sorts, backwards, cursor
+
+    def page_queryset(self, queryset, sorts):
+        """
+        The statement `paginate` reads the page rows with, e.g. to check its plan.
+        """
+        if self.mode == enums.PaginationMode.CURSOR:
+            return self._cursor_page(queryset, sorts)[0]
+        return self._offset_page(queryset, sorts).limit(self.num_per_page)
+
+    async def paginate(self, queryset, sorts):
+        if self.mode == enums.PaginationMode.CURSOR:
+            return await self.paginate_cursor(queryset, sorts)
+
+        count, count_strategy = await self.count(queryset)
+
+        page = self._offset_page(queryset, sorts)
+
+        if count_strategy == enums.CountStrategy.WINDOW:
+            # rows and total in a single statement
+            objs = await page.annotate(window_count=RawSQL("COUNT(*) OVER()")).limit(
+                self.num_per_page
+            )
+
+            # past the last page there is no row to read the total from
+            count = objs[0].window_count if objs else await queryset.count()
+            num_pages = math.ceil(count / self.num_per_page)
+        elif count is None:
+            # one extra row tells us whether there is another page
+            objs = await page.limit(self.num_per_page + 1)
+            num_pages = self.current_page + (len(objs) > self.num_per_page)
+            objs = objs[: self.num_per_page]
+        else:
+            objs = await page.limit(self.num_per_page)
+            num_pages = math.ceil(count / self.num_per_page)
+
+        return objs, Pagination(
             num_per_page=self.num_per_page,
             current_page=self.current_page,
             count=count,
-            num_pages=math.ceil(count / self.num_per_page),
+            count_strategy=count_strategy,
+            num_pages=num_pages,
+        )
+
+    async def paginate_cursor(self, queryset, sorts):
+        page, sorts, backwards, cursor = self._cursor_page(queryset, sorts)
+
+        objs = await page
+        has_more = len(objs) > self.num_per_page
+        objs = objs[: self.num_per_page]
+
+        if backwards:
+            objs.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = cursor is not None, has_more
+
+        return objs, Pagination(
+            num_per_page=self.num_per_page,
+            count_strategy=enums.CountStrategy.NONE,
+            next_cursor=encode_cursor(sorts, objs[-1]) if objs and has_next else None,
+            prev_cursor=encode_cursor(sorts, objs[0]) if objs and has_prev else None,
         )
 
 
 class Pagination(BaseModel):
     num_per_page: int
-    current_page: int
-    num_pages: int
+    current_page: Optional[int] = None
+    num_pages: Optional[int] = None
+
+    count: Optional[int] = None
+    count_strategy: enums.CountStrategy = enums.CountStrategy.EXACT
 
-    count: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
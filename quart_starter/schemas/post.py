@@ -37,6 +37,8 @@ class Post(BaseModel):
     modified_at: datetime
     published_at: Optional[datetime]
     viewed: int
+    unique_viewers: int
+    like_count: int
 
     author_id: int
     author: Optional[UserPublic]
@@ -100,11 +102,15 @@ class PostQueryString(BaseModel):
     author_id: Optional[int] = None
     pp: Optional[int] = 10
     p: Optional[int] = 1
+    mode: Optional[enums.PaginationMode] = enums.PaginationMode.OFFSET
+    count: Optional[enums.CountStrategy] = enums.CountStrategy.EXACT
+    after: Optional[str] = None
+    before: Optional[str] = None
     resolves: Optional[List[PostResolve]] = []
 
     _parse_list = field_validator("id__in", "resolves", mode="before")(parse_list)
 
-    def to_query(self, resolves=None):
+    def to_query(self, resolves=None, mode=None, count=None):
         filters = []
         if self.id__in:
             filters.append(PostFilter(field=PostFilterField.ID_IN, value=self.id__in))
@@ -119,7 +125,17 @@ class PostQueryString(BaseModel):
 
         resolves = resolves or self.resolves
         sorts = self.sort.split("__")
-        page_info = PageInfo(num_per_page=self.pp, current_page=self.p)
+        if self.after or self.before:
+            mode = enums.PaginationMode.CURSOR
+
+        page_info = PageInfo(
+            num_per_page=self.pp,
+            current_page=self.p,
+            mode=mode or self.mode,
+            count_strategy=count or self.count,
+            after=self.after,
+            before=self.before,
+        )
         return PostQuery(
             filters=filters, sorts=sorts, resolves=resolves, page_info=page_info
         )
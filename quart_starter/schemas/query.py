@@ -9,14 +9,28 @@ class Query:
     resolves: Any
     page_info: PageInfo
 
-    async def apply(self, queryset):
+    def prepare(self, queryset):
         if self.filters:
             queryset = queryset.filter(**{x.field: x.value for x in self.filters})
 
-        if self.sorts:
-            queryset = queryset.order_by(*self.sorts)
-
         if self.resolves:
-            queryset = queryset.prefetch_related(*self.resolves)
+            # forward foreign keys are joined into the page query, the rest are prefetched
+            fk_fields = queryset.model._meta.fk_fields
+            joins = [x for x in self.resolves if x in fk_fields]
+            prefetches = [x for x in self.resolves if x not in fk_fields]
+
+            if joins:
+                queryset = queryset.select_related(*joins)
+            if prefetches:
+                queryset = queryset.prefetch_related(*prefetches)
 
-        return await self.page_info.paginate(queryset)
+        return queryset
+
+    def page_queryset(self, queryset):
+        """
+        The statement reading the page rows, without running it.
+        """
+        return self.page_info.page_queryset(self.prepare(queryset), self.sorts or [])
+
+    async def apply(self, queryset):
+        return await self.page_info.paginate(self.prepare(queryset), self.sorts or [])
@@ -131,18 +131,32 @@ class UserQueryString(BaseModel):
     id__in: Optional[List[int]] = None
     pp: Optional[int] = 10
     p: Optional[int] = 1
+    mode: Optional[enums.PaginationMode] = enums.PaginationMode.OFFSET
+    count: Optional[enums.CountStrategy] = enums.CountStrategy.EXACT
+    after: Optional[str] = None
+    before: Optional[str] = None
     resolves: Optional[List[UserResolve]] = []
 
     _parse_list = field_validator("id__in", "resolves", mode="before")(parse_list)
 
-    def to_query(self, resolves=None):
+    def to_query(self, resolves=None, mode=None, count=None):
         filters = []
         if self.id__in:
             filters.append(UserFilter(field=UserFilterField.ID_IN, value=self.id__in))
 
         resolves = resolves or self.resolves
         sorts = self.sort.split("__")
-        page_info = PageInfo(num_per_page=self.pp, current_page=self.p)
+        if self.after or self.before:
+            mode = enums.PaginationMode.CURSOR
+
+        page_info = PageInfo(
+            num_per_page=self.pp,
+            current_page=self.p,
+            mode=mode or self.mode,
+            count_strategy=count or self.count,
+            after=self.after,
+            before=self.before,
+        )
         return UserQuery(
             filters=filters, sorts=sorts, resolves=resolves, page_info=page_info
         )
@@ -27,6 +27,13 @@ DB_PASSWORD = os.environ["DB_PASSWORD"]
 DB_USER = os.environ["DB_USER"]
 DB_PORT = os.environ.get("DB_PORT", -1)
 
+REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+REDIS_TIMEOUT = float(os.environ.get("REDIS_TIMEOUT", 0.5))
+# websocket broadcasts and cache invalidations go through "redis", "postgres"
+# (LISTEN/NOTIFY) or "memory" (single process only)
+PUBSUB_BACKEND = os.environ.get("PUBSUB_BACKEND", "redis")
+
 STATIC_VERSION = os.environ.get("STATIC_VERSION")
 
 SYSTEM_USER_EMAIL = "system@email.com"
@@ -42,7 +49,75 @@ AUTH_LOGOUT_SUCCESS_ENDPOINT = os.environ.get(
     "AUTH_LOGOUT_SUCCESS_ENDPOINT", "marketing.index"
 )
 
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL", 60))
+
+SESSION_TOKEN_STATELESS = strtobool(os.environ.get("SESSION_TOKEN_STATELESS", "False"))
+SESSION_TOKEN_MAX_AGE = int(os.environ.get("SESSION_TOKEN_MAX_AGE", 3600))
+REVOCATION_FILTER_CAPACITY = int(os.environ.get("REVOCATION_FILTER_CAPACITY", 100000))
+REVOCATION_FILTER_ERROR_RATE = float(
+    os.environ.get("REVOCATION_FILTER_ERROR_RATE", 0.001)
+)
+
+PASSWORD_HASH_ROUNDS = int(os.environ.get("PASSWORD_HASH_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_POOL = os.environ.get("PASSWORD_HASH_POOL", "thread")
+
+LOGIN_IP_BUCKET_SIZE = int(os.environ.get("LOGIN_IP_BUCKET_SIZE", 20))
+LOGIN_IP_REFILL_PER_MINUTE = float(os.environ.get("LOGIN_IP_REFILL_PER_MINUTE", 10))
+LOGIN_EMAIL_BUCKET_SIZE = int(os.environ.get("LOGIN_EMAIL_BUCKET_SIZE", 5))
+LOGIN_EMAIL_REFILL_PER_MINUTE = float(
+    os.environ.get("LOGIN_EMAIL_REFILL_PER_MINUTE", 2)
+)
+LOGIN_MAX_CONCURRENT_VERIFICATIONS = int(
+    os.environ.get("LOGIN_MAX_CONCURRENT_VERIFICATIONS", 4)
+)
+
+COUNT_CACHE_SIZE = int(os.environ.get("COUNT_CACHE_SIZE", 1000))
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 30))
+COUNT_ESTIMATE_THRESHOLD = int(os.environ.get("COUNT_ESTIMATE_THRESHOLD", 10000))
+
+POST_VIEW_FLUSH_INTERVAL = float(os.environ.get("POST_VIEW_FLUSH_INTERVAL", 5))
+POST_VIEW_FLUSH_THRESHOLD = int(os.environ.get("POST_VIEW_FLUSH_THRESHOLD", 1000))
+
+POST_VIEWERS_SNAPSHOT_INTERVAL = float(
+    os.environ.get("POST_VIEWERS_SNAPSHOT_INTERVAL", 60)
+)
+POST_VIEWERS_TTL = int(os.environ.get("POST_VIEWERS_TTL", 86400))
+
+# messages queued per websocket, then the oldest is dropped ("drop_oldest") or
+# the client is disconnected ("disconnect")
+WEBSOCKET_SEND_QUEUE_SIZE = int(os.environ.get("WEBSOCKET_SEND_QUEUE_SIZE", 100))
+WEBSOCKET_SLOW_CONSUMER_POLICY = os.environ.get(
+    "WEBSOCKET_SLOW_CONSUMER_POLICY", "drop_oldest"
+)
+# channels are spread over this many pubsub connections, subscription changes
+# made within the batch window go out as a single command per connection
+WEBSOCKET_PUBSUB_CONNECTIONS = int(os.environ.get("WEBSOCKET_PUBSUB_CONNECTIONS", 4))
+WEBSOCKET_SUBSCRIBE_BATCH_MS = int(os.environ.get("WEBSOCKET_SUBSCRIBE_BATCH_MS", 10))
+# broadcasts only go through Redis when other nodes have websockets in the channel,
+# nodes stay listed for the TTL and are looked up at most once per cache TTL
+WEBSOCKET_PRESENCE_TTL = float(os.environ.get("WEBSOCKET_PRESENCE_TTL", 30))
+WEBSOCKET_PRESENCE_CACHE_TTL = float(os.environ.get("WEBSOCKET_PRESENCE_CACHE_TTL", 1))
+# live counters such as post views are broadcast at most once per window
+WEBSOCKET_COALESCE_MS = int(os.environ.get("WEBSOCKET_COALESCE_MS", 250))
+
 WEBHOOK_URL = "http://127.0.0.1:5000/event/webhook"
+# default for process-events --concurrency
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", 5))
+WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", 5))
+# above 1, up to this many events are posted together as a JSON array
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 1))
+WEBHOOK_BATCH_WAIT_MS = int(os.environ.get("WEBHOOK_BATCH_WAIT_MS", 50))
+# concurrency backs off while responses are slower than this
+WEBHOOK_TARGET_LATENCY = float(os.environ.get("WEBHOOK_TARGET_LATENCY", 1))
+# consecutive failures that stop deliveries for WEBHOOK_BREAKER_RESET seconds
+WEBHOOK_BREAKER_FAILURES = int(os.environ.get("WEBHOOK_BREAKER_FAILURES", 5))
+WEBHOOK_BREAKER_RESET = float(os.environ.get("WEBHOOK_BREAKER_RESET", 30))
+# workers are woken up by notifications, polling only catches ones that were missed
+EVENT_POLL_INTERVAL = float(os.environ.get("EVENT_POLL_INTERVAL", 30))
+# claims of workers that stop renewing are reclaimed this many seconds later
+EVENT_LEASE_DURATION = float(os.environ.get("EVENT_LEASE_DURATION", 60))
 
 TORTOISE_ORM_DEBUG_QUERY = False
 
@@ -0,0 +1,12 @@
+import os
+
+import pytest
+
+# settings requires these, integration runs take them from the environment
+for name in ("SECRET_KEY", "DB_NAME", "DB_HOST", "DB_PASSWORD", "DB_USER"):
+    os.environ.setdefault(name, "test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,112 @@
+import pytest
+from tortoise import Tortoise, connections
+
+from quart_starter import actions, enums, models, schemas
+
+pytestmark = pytest.mark.anyio
+
+NUM_POSTS = 30
+
+
+@pytest.fixture(name="admin")
+async def admin_fixture():
+    # SQLite is enough to count statements, the SQL only has to run
+    await Tortoise.init(
+        db_url="sqlite://:memory:", modules={"models": ["quart_starter.models"]}
+    )
+    await Tortoise.generate_schemas()
+
+    user = await models.User.create(
+        email="admin@example.com", name="Admin", role=enums.UserRole.ADMIN
+    )
+    for i in range(NUM_POSTS):
+        await models.User.create(email=f"user{i}@example.com", name=f"User {i}")
+
+        post = await models.Post.create(
+            title=f"Post {i}", content="Content", author_id=user.id
+        )
+        post.update_status(enums.PostStatus.PUBLISHED)
+        await post.save()
+
+    yield schemas.User.model_validate(user)
+
+    await Tortoise.close_connections()
+
+
+@pytest.fixture(name="statements")
+def statements_fixture(admin, monkeypatch):  # pylint: disable=unused-argument
+    """
+    SQL issued through the default connection once the data is seeded.
+    """
+    statements = []
+    client = connections.get("default")
+
+    for name in ("execute_query", "execute_query_dict"):
+        original = getattr(client, name)
+
+        def counting(query, values=None, original=original):
+            statements.append(query)
+            return original(query, values)
+
+        monkeypatch.setattr(client, name, counting)
+
+    return statements
+
+
+@pytest.mark.parametrize("num_per_page", [1, 10, 50])
+@pytest.mark.parametrize(
+    "count,expected",
+    [
+        (enums.CountStrategy.WINDOW, 1),
+        (enums.CountStrategy.NONE, 1),
+        (enums.CountStrategy.EXACT, 2),
+    ],
+)
+async def test_post_list_statements(admin, statements, num_per_page, count, expected):
+    q = schemas.PostQueryString(pp=num_per_page, count=count, resolves=["author"])
+
+    result = await actions.post.query(admin, q.to_query())
+
+    assert len(statements) == expected
+    assert len(result.posts) == min(num_per_page, NUM_POSTS)
+    assert all(post.author is not None for post in result.posts)
+
+
+@pytest.mark.parametrize("num_per_page", [1, 10, 50])
+async def test_post_list_cursor_statements(admin, statements, num_per_page):
+    q = schemas.PostQueryString(
+        pp=num_per_page, mode=enums.PaginationMode.CURSOR, resolves=["author"]
+    )
+
+    result = await actions.post.query(admin, q.to_query())
+
+    assert len(statements) == 1
+    assert len(result.posts) == min(num_per_page, NUM_POSTS)
+
+
+@pytest.mark.parametrize("num_per_page", [1, 10, 50])
+@pytest.mark.parametrize(
+    "count,expected",
+    [
+        (enums.CountStrategy.WINDOW, 1),
+        (enums.CountStrategy.NONE, 1),
+        (enums.CountStrategy.EXACT, 2),
+    ],
+)
+async def test_user_list_statements(admin, statements, num_per_page, count, expected):
+    q = schemas.UserQueryString(pp=num_per_page, count=count)
+
+    result = await actions.user.query(admin, q.to_query())
+
+    assert len(statements) == expected
+    assert len(result.users) == min(num_per_page, NUM_POSTS + 1)
+
+
+async def test_window_count_past_last_page(admin, statements):
+    # there is no row to read the total from, so it is counted separately
+    q = schemas.PostQueryString(p=100, count=enums.CountStrategy.WINDOW)
+
+    result = await actions.post.query(admin, q.to_query())
+
+    assert len(statements) == 2
+    assert result.pagination.count == NUM_POSTS
@@ -0,0 +1,129 @@
+import asyncio
+import uuid
+
+import pytest
+from tortoise import Tortoise
+
+from quart_starter import settings
+from quart_starter.lib.pubsub import PUBSUB_ERRORS, get_pubsub_manager
+
+pytestmark = pytest.mark.anyio
+
+BACKENDS = [
+    "memory",
+    pytest.param("postgres", marks=pytest.mark.integration),
+    pytest.param("redis", marks=pytest.mark.integration),
+]
+
+
+def text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+async def next_message(subscriber, timeout: float = 2):
+    # Redis returns None for every read that times out, so keep reading until the
+    # deadline rather than trusting a single read
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        message = await subscriber.get_message(
+            ignore_subscribe_messages=True, timeout=0.1
+        )
+        if message is not None:
+            return message
+    return None
+
+
+@pytest.fixture(name="backend", params=BACKENDS)
+async def backend_fixture(request):
+    if request.param == "postgres":
+        await Tortoise.init(config=settings.TORTOISE_ORM)
+        yield request.param
+        await Tortoise.close_connections()
+    else:
+        yield request.param
+
+
+@pytest.fixture(name="channel_id")
+def channel_id_fixture():
+    return f"test-{uuid.uuid4().hex}"
+
+
+async def test_subscribe_message_shape(backend, channel_id):
+    manager = get_pubsub_manager(backend)
+    await manager.connect()
+    subscriber = await manager.subscribe(channel_id)
+
+    message = await subscriber.get_message(timeout=2)
+    assert message["type"] == "subscribe"
+    assert text(message["channel"]) == channel_id
+    assert message["data"] == 1
+
+    await manager.unsubscribe(channel_id)
+
+
+async def test_subscribe_message_ignored(backend, channel_id):
+    manager = get_pubsub_manager(backend)
+    await manager.connect()
+    subscriber = await manager.subscribe(channel_id)
+
+    assert (
+        await subscriber.get_message(ignore_subscribe_messages=True, timeout=0.5)
+        is None
+    )
+
+    await manager.unsubscribe(channel_id)
+
+
+async def test_publish_reaches_subscriber(backend, channel_id):
+    publisher = get_pubsub_manager(backend)
+    manager = get_pubsub_manager(backend)
+    await publisher.connect()
+    await manager.connect()
+    subscriber = await manager.subscribe(channel_id)
+
+    await publisher.publish(channel_id, "hello")
+
+    message = await next_message(subscriber)
+    assert message["type"] == "message"
+    assert text(message["channel"]) == channel_id
+    assert text(message["data"]) == "hello"
+
+    await manager.unsubscribe(channel_id)
+
+
+async def test_unsubscribe_stops_delivery(backend, channel_id):
+    publisher = get_pubsub_manager(backend)
+    manager = get_pubsub_manager(backend)
+    await publisher.connect()
+    await manager.connect()
+    subscriber = await manager.subscribe(channel_id)
+    await manager.unsubscribe(channel_id)
+
+    await publisher.publish(channel_id, "hello")
+
+    assert await next_message(subscriber, timeout=0.5) is None
+
+
+async def test_queued_error_is_raised(channel_id):
+    manager = get_pubsub_manager("memory")
+    subscriber = await manager.subscribe(channel_id)
+    await subscriber.get_message(timeout=1)  # subscribe confirmation
+    subscriber.put_exception(ConnectionError("listener connection lost"))
+
+    with pytest.raises(ConnectionError):
+        await subscriber.get_message(ignore_subscribe_messages=True, timeout=1)
+
+    await manager.unsubscribe(channel_id)
+
+
+@pytest.mark.integration
+async def test_postgres_publish_error_is_pubsub_error(channel_id):
+    await Tortoise.init(config=settings.TORTOISE_ORM)
+    try:
+        manager = get_pubsub_manager("postgres")
+
+        # NOTIFY payloads are limited to 8000 bytes
+        with pytest.raises(PUBSUB_ERRORS):
+            await manager.publish(channel_id, "x" * 10000)
+    finally:
+        await Tortoise.close_connections()